@@ -6,14 +6,27 @@ und 7-Tage & 13-Monate Historie.
 """
 
 import os
-import sys
 import time
 import json
+import math
+import random
+import mmap
+import codecs
+import hashlib
 import logging
 import requests
+import threading
 import urllib.parse
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, compress
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from zoneinfo import ZoneInfo
+from requests.adapters import HTTPAdapter
 import paho.mqtt.client as mqtt
+import websocket
 from playwright.sync_api import sync_playwright
 
 # --- KONFIGURATION ---
@@ -25,7 +38,18 @@ MQTT_USERNAME = os.getenv('MQTT_USERNAME', '')
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', '')
 MQTT_TOPIC_PREFIX = os.getenv('MQTT_TOPIC_PREFIX', 'digimeto')
 UPDATE_INTERVAL = int(os.getenv('UPDATE_INTERVAL', 3600))
+FULL_REFRESH_HOURS = int(os.getenv('FULL_REFRESH_HOURS', 24))
+MAX_PARALLEL_METERS = max(1, int(os.getenv('MAX_PARALLEL_METERS', 4)))
+IMPORT_STATISTICS = os.getenv('IMPORT_STATISTICS', 'true').lower() == 'true'
+HA_WEBSOCKET_URL = os.getenv('HA_WEBSOCKET_URL', 'ws://supervisor/core/websocket')
+SUPERVISOR_TOKEN = os.getenv('SUPERVISOR_TOKEN', '')
+TARIFF_HT_PRICE = float(os.getenv('TARIFF_HT_PRICE') or 0)  # €/kWh, 0 = keine Kostenberechnung
+TARIFF_NT_PRICE = float(os.getenv('TARIFF_NT_PRICE') or 0)
+TARIFF_HT_START = os.getenv('TARIFF_HT_START') or '06:00'
+TARIFF_HT_END = os.getenv('TARIFF_HT_END') or '22:00'
+TARIFF_WEEKEND_NT = os.getenv('TARIFF_WEEKEND_NT', 'true').lower() == 'true'
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+TZ = ZoneInfo(os.getenv('TZ') or 'Europe/Berlin')
 
 logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -33,14 +57,724 @@ logger = logging.getLogger(__name__)
 DIGIMETO_BASE_URL = "https://vdis5.digimeto.de"
 DIGIMETO_LOGIN_URL = f"{DIGIMETO_BASE_URL}/login"
 
+HISTORY_DIR = "/data/digimeto_history"
+BROWSER_PROFILE_DIR = "/data/digimeto_browser"  # persistentes Chromium-Profil (Remember-Me, Cache)
+HISTORY_DAYS = 1095  # 3 Jahre Historie beim Erstabruf
+PERIODS = ["15mins", "days", "months", "years"]
+FETCH_WORKERS = len(PERIODS)  # alle Perioden parallel abrufen
+METER_REGISTRY_FILE = "/data/digimeto_meters.json"
+METER_REGISTRY_TTL = 86400  # Zählpunkt-Baum 1x täglich neu einlesen
+STREAM_CHUNK_SIZE = 64 * 1024
+HASH_BUFFER_LIMIT = 1024 * 1024  # kleinere Antworten erst hashen, dann (nur bei Änderung) dekodieren
+VALIDATOR_FILE = "/data/digimeto_validators.json"
+META_KEYS = ('details', 'metpointname', 'unit')  # alles andere aus der Antwort wird verworfen
+CROSS_CHECK_INTERVAL = 86400  # Portal-Aggregate (Tage/Monate/Jahre) nur 1x täglich abrufen
+CROSS_CHECK_TOLERANCE = 0.005  # 0,5 % Abweichung zwischen Rollup und Portal sind ok
+DIGEST_FILE = "/data/digimeto_mqtt_digest.json"
+HA_STATUS_TOPIC = "homeassistant/status"
+MQTT_QUEUE_FILE = "/data/digimeto_mqtt_queue.json"
+MQTT_QUEUE_LIMIT = 10000  # max. gepufferte Topics
+MQTT_DRAIN_RATE = 100  # Nachrichten pro Sekunde beim Abarbeiten der Warteschlange
+MQTT_RECONNECT_MAX = 120  # max. Wartezeit zwischen Reconnect-Versuchen (s)
+HTML_HEADERS = {'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8', 'X-Requested-With': None}
+INTERVAL_SECONDS = 900  # Raster der Lastgangwerte
+POLL_MARGIN = 120  # so lange nach erwarteter Veröffentlichung abfragen
+RETRY_BASE = 300  # erster Wiederholungsabstand bei Fehlern / ausbleibenden Daten
+RETRY_MAX = 6 * 3600
+GAP_STATE_FILE = "/data/digimeto_gaps.json"
+GAP_MERGE_DISTANCE = 86400  # Lücken mit weniger als einem Tag Abstand in einem Abruf bündeln
+GAP_REQUESTS_PER_CYCLE = 4  # max. Nachlade-Abrufe je Zähler und Zyklus
+GAP_MAX_ATTEMPTS = 3  # danach gilt eine Lücke als dauerhaft (Portal hat keine Werte)
+LOAD_DURATION_DAYS = 365  # Zeitraum der Lastdauerlinie
+LAG_ALPHA = 0.3  # Glättung der gelernten Portal-Verzögerung
+SESSION_KEEPALIVE = 20 * 60  # Server-Session vor dem Idle-Timeout anstoßen
+SESSION_REFRESH_MARGIN = 10 * 60  # Cookies so lange vor Ablauf erneuern
+SESSION_VERIFY_TTL = 5 * 60  # kürzlich bestätigte Session nicht erneut prüfen
+LOGIN_BACKOFF_BASE = 5 * 60
+LOGIN_BACKOFF_MAX = 6 * 3600
+STATISTICS_STATE_FILE = "/data/digimeto_statistics.json"
+STATISTICS_OVERLAP = 48 * 3600  # späte Korrekturen: letzte 48 h bei jedem Import erneut senden
+STATISTICS_BATCH = 1000  # Stunden pro recorder/import_statistics-Aufruf
+
+
+def _parse_ts(ts):
+    return datetime.fromisoformat(ts.replace('Z', '+00:00'))
+
+
+def _to_epoch(ts):
+    dt = _parse_ts(ts)
+    if not dt.tzinfo: dt = dt.replace(tzinfo=TZ)
+    return int(dt.timestamp())
+
+
+def _local(epoch):
+    return datetime.fromtimestamp(epoch, TZ)
+
+
+def _epoch(dt):
+    return int(dt.timestamp())
+
+
+def _format_ts(dt):
+    return dt.isoformat(timespec='seconds')
+
+
+def _window_start(period, high_water):
+    # Fenster ab dem letzten vollständigen Intervall, mit etwas Überlappung für nachträgliche Korrekturen
+    if period == '15mins':
+        return high_water - timedelta(hours=2)
+    if period == 'days':
+        return (high_water - timedelta(days=2)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'months':
+        start = high_water.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return (start - timedelta(days=1)).replace(day=1)
+    return high_water.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+class Series:
+    # Kompakte Zeitreihe: int64-Epochen (Sekunden, aufsteigend) und float64-Werte
+    __slots__ = ('epochs', 'values')
+
+    def __init__(self, epochs=None, values=None):
+        self.epochs = epochs if epochs is not None else array('q')
+        self.values = values if values is not None else array('d')
+
+    @classmethod
+    def from_arrays(cls, epochs, values):
+        # Fehlende Werte (null -> NaN) fallen heraus, die Lücke bleibt im Index sichtbar
+        n = min(len(epochs), len(values))
+        epochs, values = epochs[:n], values[:n]
+        if any(map(math.isnan, values)):
+            keep = [not math.isnan(v) for v in values]
+            epochs, values = array('q', compress(epochs, keep)), array('d', compress(values, keep))
+        return cls(epochs, values)
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def index(self, epoch):
+        return bisect_left(self.epochs, epoch)
+
+    def window_sum(self, start, end):
+        # Summe aller Werte mit start <= Epoche < end (zwei Binärsuchen statt Vollscan)
+        return math.fsum(self.values[self.index(start):self.index(end)])
+
+
+class _JSONStream:
+    # Minimaler inkrementeller JSON-Leser über einen Byte-Chunk-Iterator
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _more(self):
+        if self._eof: return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._utf8.decode(b'', final=True)
+        else:
+            text = self._utf8.decode(chunk)
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\r\n': self._pos += 1
+            if self._pos < len(self._buf): return self._buf[self._pos]
+            if not self._more(): raise ValueError("Unerwartetes Ende der JSON-Antwort")
+
+    def take(self):
+        c = self.peek()
+        self._pos += 1
+        return c
+
+    def expect(self, c):
+        if self.take() != c: raise ValueError(f"JSON: '{c}' erwartet")
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                val, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Zahl am Pufferende könnte abgeschnitten sein -> nachladen
+                if self._eof or (end < len(self._buf) and self._buf[end] in ',]}: \t\r\n'):
+                    self._pos = end
+                    return val
+            except json.JSONDecodeError:
+                if self._eof: raise
+            self._more()
+
+    def items(self):
+        # Iteriert die Elemente eines Arrays, ohne es komplett im Speicher zu halten
+        self.expect('[')
+        if self.peek() == ']':
+            self.take(); return
+        while True:
+            yield self.value()
+            if self.take() == ']': return
+
+
+def _stream_series(chunks):
+    # Liest timestamps/values direkt in kompakte Arrays; es bleiben nur Metadaten und die Reihe
+    stream = _JSONStream(chunks)
+    meta, epochs, values = {}, array('q'), array('d')
+    stream.expect('{')
+    if stream.peek() == '}': return meta, Series()
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'timestamps' and stream.peek() == '[':
+            for ts in stream.items(): epochs.append(_to_epoch(ts))
+        elif key == 'values' and stream.peek() == '[':
+            for val in stream.items(): values.append(math.nan if val is None else float(val))
+        elif stream.peek() == '[':
+            for _ in stream.items(): pass
+        elif key in META_KEYS:
+            meta[key] = stream.value()
+        else:
+            stream.value()
+        if stream.take() == '}': break
+    return meta, Series.from_arrays(epochs, values)
+
+
+UNCHANGED = object()  # Antwort identisch zum letzten Abruf (304 oder gleicher Hash)
+
+
+def _fsync_write(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _map_column(path, count, code):
+    # Spalte per mmap einblenden; Slices darauf sind Zero-Copy-Views
+    if not count: return array(code)
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), count * 8, access=mmap.ACCESS_READ)
+    return memoryview(mm).cast(code)
+
+
+class HistoryStore:
+    # Spaltenorientierter Zeitreihen-Speicher unter /data, je Zählpunkt und Periode:
+    #   <name>.json       Commit-Punkt (Generation, Anzahl gültiger Einträge, Metadaten)
+    #   <name>.<gen>.idx  int64-Epochen (aufsteigend), <name>.<gen>.val  float64-Werte
+    # Anhänge landen hinter dem committeten Ende und werden erst durch das atomare Ersetzen
+    # der JSON-Datei gültig; ein Absturz hinterlässt höchstens einen ignorierten Rest.
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.heads = {}
+        self.cache = {}
+        self.lock = threading.RLock()  # mehrere Zähler werden parallel gemerged
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'): continue
+            try:
+                with open(os.path.join(self.path, name), 'r') as f:
+                    head = json.load(f)
+                if head.get('version') != self.VERSION: continue
+                self.heads[head['key']] = head
+                self._cleanup(head)
+            except Exception as e:
+                logger.warning(f"Historie {name} nicht lesbar, wird neu geladen: {e}")
+        if self.heads: logger.info(f"Historie geladen ({len(self.heads)} Zeitreihen).")
+
+    def _file(self, key, suffix):
+        return os.path.join(self.path, f"{key.replace('/', '_')}{suffix}")
+
+    def _column(self, head, ext):
+        return self._file(head['key'], f".{head['gen']}.{ext}")
+
+    def _cleanup(self, head):
+        # Alte Generationen und nicht committete Reste entfernen
+        prefix = os.path.basename(self._file(head['key'], '.'))
+        current = {os.path.basename(self._column(head, ext)) for ext in ('idx', 'val')}
+        for name in os.listdir(self.path):
+            if name.startswith(prefix) and name not in current and not name.endswith('.json'):
+                os.remove(os.path.join(self.path, name))
+        for ext in ('idx', 'val'):
+            path = self._column(head, ext)
+            if os.path.exists(path) and os.path.getsize(path) > head['count'] * 8:
+                os.truncate(path, head['count'] * 8)
+
+    def _commit(self, head):
+        _fsync_write(self._file(head['key'], '.json'), json.dumps(head).encode())
+        self.heads[head['key']] = head
+        self.cache.pop(head['key'], None)
+
+    @staticmethod
+    def key(mp_id1, mp_id2, period):
+        return f"{mp_id1}/{mp_id2}/{period}"
+
+    def series(self, key):
+        with self.lock:
+            head = self.heads.get(key)
+            if not head: return None
+            if key not in self.cache:
+                self.cache[key] = Series(_map_column(self._column(head, 'idx'), head['count'], 'q'),
+                                         _map_column(self._column(head, 'val'), head['count'], 'd'))
+            return self.cache[key]
+
+    def high_water(self, key):
+        series = self.series(key)
+        return series.epochs[-1] if series else None
+
+    def _write_generation(self, key, series, meta):
+        gen = self.heads[key]['gen'] + 1 if key in self.heads else 0
+        head = {'version': self.VERSION, 'key': key, 'gen': gen, 'count': len(series), 'meta': meta, 'fetched': int(time.time())}
+        _fsync_write(self._column(head, 'idx'), series.epochs.tobytes())
+        _fsync_write(self._column(head, 'val'), series.values.tobytes())
+        self._commit(head)
+        self._cleanup(head)
+
+    def _append(self, head, series):
+        for ext, column in (('idx', series.epochs), ('val', series.values)):
+            with open(self._column(head, ext), 'r+b') as f:
+                f.truncate(head['count'] * 8)
+                f.seek(head['count'] * 8)
+                f.write(column.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def fetched(self, key):
+        return self.heads.get(key, {}).get('fetched')
+
+    def merge(self, key, incoming, meta, window_start=None):
+        with self.lock:
+            self._merge(key, incoming, meta, window_start)
+
+    def _merge(self, key, incoming, meta, window_start):
+        if not incoming:
+            if key in self.heads: self._commit(dict(self.heads[key], fetched=int(time.time())))
+            return
+        current = self.series(key)
+        if window_start is None or not current:
+            self._write_generation(key, incoming, meta)
+            return
+
+        head = dict(self.heads[key], meta=meta, fetched=int(time.time()))
+        last = current.epochs[-1]
+        split = bisect_left(incoming.epochs, last + 1)
+        # Überlappung: geänderte Werte an Ort und Stelle korrigieren, fehlende Slots einsortieren
+        corrections, inserts = [], Series()
+        for epoch, val in zip(incoming.epochs[:split], incoming.values[:split]):
+            i = current.index(epoch)
+            if i < len(current) and current.epochs[i] == epoch:
+                if current.values[i] != val: corrections.append((i, epoch, val))
+            else:
+                inserts.epochs.append(epoch); inserts.values.append(val)
+        if inserts:
+            # Einsortieren verschiebt die Slots: Korrekturen gehen über extra in die neue Generation
+            for _, epoch, val in corrections:
+                inserts.epochs.append(epoch); inserts.values.append(val)
+            self.compact(key, inserts, meta)
+            head = dict(self.heads[key])
+        elif corrections:
+            with open(self._column(head, 'val'), 'r+b') as f:
+                for i, _, val in corrections:
+                    f.seek(i * 8)
+                    f.write(array('d', [val]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        if corrections:
+            logger.debug(f"{len(corrections)} korrigierte Werte in {key}")
+
+        tail = Series(incoming.epochs[split:], incoming.values[split:])
+        if tail:
+            self._append(head, tail)
+            head['count'] += len(tail)
+        self._commit(head)
+
+    def compact(self, key, extra=None, meta=None):
+        # Schreibt eine neue, sortierte und duplikatfreie Generation (extra überschreibt gleiche Epochen)
+        with self.lock:
+            self._compact(key, extra, meta)
+
+    def _compact(self, key, extra, meta):
+        current = self.series(key) or Series()
+        merged = dict(zip(current.epochs, current.values))
+        if extra: merged.update(zip(extra.epochs, extra.values))
+        epochs = sorted(merged)
+        series = Series(array('q', epochs), array('d', (merged[e] for e in epochs)))
+        self.cache.pop(key, None)
+        self._write_generation(key, series, meta if meta is not None else self.heads.get(key, {}).get('meta', {}))
+
+    def get(self, key):
+        series = self.series(key)
+        if series is None: return None
+        return {**self.heads[key].get('meta', {}), 'series': series}
+
+def _bucket_start(period, dt):
+    if period == 'days': return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'months': return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return dt.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _bucket_next(period, dt):
+    # Kalenderarithmetik in Ortszeit: ein Tag hat an DST-Tagen 23 bzw. 25 Stunden
+    if period == 'days': return dt + timedelta(days=1)
+    if period == 'months': return dt.replace(year=dt.year + dt.month // 12, month=dt.month % 12 + 1)
+    return dt.replace(year=dt.year + 1)
+
+
+class RollupEngine:
+    # Leitet Tages-, Monats- und Jahressummen lokal aus den 15-Minuten-Werten ab (Europe/Berlin).
+    # Die Bucket-Struktur folgt der zuletzt geladenen Portal-Reihe; Werte für Buckets, die
+    # vollständig von 15-Minuten-Daten abgedeckt sind, werden lokal neu berechnet.
+    @staticmethod
+    def _sum(intervals, start, end):
+        return intervals.window_sum(_epoch(start), _epoch(end))
+
+    @staticmethod
+    def _coverage(period, intervals, now):
+        # Erster vollständig abgedeckter Bucket und Ende der Daten (letztes Intervall + 15 min);
+        # der laufende Bucket wird bis dorthin summiert, abgeschlossene nur bei voller Abdeckung
+        first = _local(intervals.epochs[0])
+        covered = _bucket_start(period, first)
+        if covered != first: covered = _bucket_next(period, covered)
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return covered, today, _local(intervals.epochs[-1] + INTERVAL_SECONDS)
+
+    def derive(self, period, intervals, portal, fetched, now):
+        if not intervals: return portal
+        covered, today, cutoff = self._coverage(period, intervals, now)
+
+        derived = Series()
+        last = None
+        for epoch, val in zip(portal.epochs, portal.values) if portal else ():
+            start = _bucket_start(period, _local(epoch))
+            end = _bucket_next(period, start)
+            if start >= covered and (end <= cutoff or (end > today and start < cutoff)):
+                val = self._sum(intervals, start, min(end, cutoff))
+            derived.epochs.append(epoch); derived.values.append(val)
+            last = start
+
+        # Angebrochene Buckets nur, wenn das Portal sie beim letzten Abruf auch geliefert hat
+        partial = bool(last and fetched and _epoch(_bucket_next(period, last)) > fetched)
+        start = _bucket_next(period, last) if last else covered
+        while start < cutoff:
+            end = _bucket_next(period, start)
+            if end > cutoff and not (partial and end > today): break
+            derived.epochs.append(_epoch(start)); derived.values.append(self._sum(intervals, start, min(end, cutoff)))
+            start = end
+        return derived
+
+    def cross_check(self, period, intervals, portal, now):
+        # Vergleicht abgeschlossene, vollständig abgedeckte Buckets mit den Portal-Aggregaten
+        if not intervals or not portal: return
+        covered, _, cutoff = self._coverage(period, intervals, now)
+        checked, deviations = 0, []
+        for epoch, val in zip(portal.epochs, portal.values):
+            start = _bucket_start(period, _local(epoch))
+            end = _bucket_next(period, start)
+            if start < covered or end > cutoff: continue
+            local = self._sum(intervals, start, end)
+            checked += 1
+            if abs(local - val) > max(0.01, abs(val) * CROSS_CHECK_TOLERANCE):
+                deviations.append(f"{start.date()}: lokal {local:.3f} / Portal {val:.3f}")
+        if deviations:
+            logger.warning(f"Rollup-Abgleich {period}: {len(deviations)} von {checked} Werten weichen ab, z.B. {deviations[-1]}")
+        else:
+            logger.info(f"Rollup-Abgleich {period}: {checked} Werte stimmen mit dem Portal überein")
+
+
+def _minutes(hhmm):
+    h, _, m = hhmm.partition(':')
+    return int(h) * 60 + int(m or 0)
+
+
+class TariffEngine:
+    # Kosten nach HT/NT-Zeitfenstern, Leistungsspitzen und Lastdauerlinie auf den 15-Minuten-Werten.
+    # Alle Summen laufen über ein Präfixsummen-Array: je Tag und Tarif-Fenster nur zwei Binärsuchen,
+    # unabhängig davon, wie viele Intervalle im Fenster liegen.
+    def __init__(self, ht_price, nt_price, ht_start, ht_end, weekend_nt):
+        self.ht_price, self.nt_price = ht_price, nt_price
+        self.ht_start, self.ht_end = _minutes(ht_start), _minutes(ht_end)
+        self.weekend_nt = weekend_nt
+
+    @property
+    def enabled(self):
+        return self.ht_price > 0 or self.nt_price > 0
+
+    @staticmethod
+    def _prefix(series):
+        # Je evaluate()-Aufruf neu aufgebaut: die Engine wird von allen Zähler-Threads geteilt
+        cum = array('d', [0.0])
+        cum.extend(accumulate(series.values))
+        return cum
+
+    @staticmethod
+    def _sum(series, cum, start, end):
+        return cum[series.index(end)] - cum[series.index(start)]
+
+    def _ht_windows(self, day):
+        if self.weekend_nt and day.weekday() >= 5: return []
+        start, end = day + timedelta(minutes=self.ht_start), day + timedelta(minutes=self.ht_end)
+        if self.ht_end > self.ht_start: return [(start, end)]
+        # HT über Mitternacht, z.B. 22:00-06:00
+        return [(day, end), (start, _bucket_next('days', day))]
+
+    def cost(self, series, cum, start, end):
+        total, day = 0.0, _bucket_start('days', start)
+        lo_end = _epoch(end)
+        while day < end:
+            nxt = _bucket_next('days', day)
+            lo, hi = max(_epoch(day), _epoch(start)), min(_epoch(nxt), lo_end)
+            energy = self._sum(series, cum, lo, hi)
+            ht = sum(self._sum(series, cum, max(lo, _epoch(a)), min(hi, _epoch(b)))
+                     for a, b in self._ht_windows(day) if _epoch(a) < hi and _epoch(b) > lo)
+            total += ht * self.ht_price + (energy - ht) * self.nt_price
+            day = nxt
+        return total
+
+    @staticmethod
+    def peak(series, start, end):
+        # Höchster Viertelstundenwert im Zeitraum als Leistung in kW
+        window = series.values[series.index(_epoch(start)):series.index(_epoch(end))]
+        return max(window, default=0.0) * 4
+
+    @staticmethod
+    def load_duration(series, start):
+        # Lastdauerlinie: Viertelstundenwerte ab start absteigend sortiert
+        return sorted(series.values[series.index(_epoch(start)):], reverse=True)
+
+    def evaluate(self, series, now):
+        if not series: return {}
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        month = _bucket_start('months', today)
+        year = _bucket_start('years', today)
+        last_month = _bucket_start('months', month - timedelta(days=1))
+        end = _local(series.epochs[-1] + INTERVAL_SECONDS)
+
+        result = {
+            'peak_current_month': round(self.peak(series, month, end), 3),
+            'peak_last_month': round(self.peak(series, last_month, month), 3),
+        }
+        curve = self.load_duration(series, today - timedelta(days=LOAD_DURATION_DAYS))
+        if curve:
+            for name, q in (('load_p50', 0.5), ('load_p90', 0.1), ('load_p99', 0.01)):
+                result[name] = round(curve[int(q * (len(curve) - 1))] * 4, 3)
+        if self.enabled:
+            cum = self._prefix(series)
+            result.update({
+                'cost_today': round(self.cost(series, cum, today, end), 2),
+                'cost_current_month': round(self.cost(series, cum, month, end), 2),
+                'cost_current_year': round(self.cost(series, cum, year, end), 2),
+            })
+        return result
+
+
+class _LoginFormParser(HTMLParser):
+    # Findet das Symfony-Login-Formular (Feld _username) samt action und aller Input-Felder (CSRF etc.)
+    def __init__(self):
+        super().__init__()
+        self.action, self.fields, self.found = None, {}, False
+        self._form = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form' and not self.found:
+            self._form = {'action': attrs.get('action'), 'fields': {}}
+        elif tag == 'input' and self._form is not None and attrs.get('name'):
+            if attrs.get('type') in ('checkbox', 'radio') and 'checked' not in attrs: return
+            self._form['fields'][attrs['name']] = attrs.get('value') or ''
+
+    def handle_endtag(self, tag):
+        if tag == 'form' and self._form is not None:
+            if '_username' in self._form['fields']:
+                self.action, self.fields, self.found = self._form['action'], self._form['fields'], True
+            self._form = None
+
+
+class GapTracker:
+    # Vergleicht erwartete mit vorhandenen 15-Minuten-Slots und plant gebündelte Nachlade-Abrufe.
+    # Fehlversuche je Lücke werden in /data gezählt, damit dauerhafte Lücken nicht endlos abgefragt werden.
+    def __init__(self, path=GAP_STATE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {}  # key -> {'attempts': {Lückenbeginn: Versuche}, 'backfilled': Slots}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.state = json.load(f)
+            except Exception as e:
+                logger.warning(f"Lücken-Status nicht lesbar: {e}")
+
+    @staticmethod
+    def find(series):
+        # [(erste fehlende Epoche, nächste vorhandene Epoche)]
+        if not series: return []
+        epochs = series.epochs
+        if (epochs[-1] - epochs[0]) // INTERVAL_SECONDS + 1 == len(epochs): return []
+        return [(a + INTERVAL_SECONDS, b) for a, b in zip(epochs, epochs[1:]) if b - a > INTERVAL_SECONDS]
+
+    @staticmethod
+    def missing(gaps):
+        return sum((b - a) // INTERVAL_SECONDS for a, b in gaps)
+
+    def plan(self, key, gaps):
+        # Neueste Lücken zuerst, benachbarte zu einem Abruffenster zusammenfassen
+        attempts = self.state.get(key, {}).get('attempts', {})
+        windows = []
+        for a, b in sorted(gaps, reverse=True):
+            if attempts.get(str(a), 0) >= GAP_MAX_ATTEMPTS: continue
+            if windows and windows[-1][0] - b <= GAP_MERGE_DISTANCE:
+                windows[-1][0] = a
+                windows[-1][2].append((a, b))
+            elif len(windows) < GAP_REQUESTS_PER_CYCLE:
+                windows.append([a, b, [(a, b)]])
+        return windows
+
+    def record(self, key, windows, remaining, filled):
+        with self.lock:
+            entry = self.state.setdefault(key, {'attempts': {}, 'backfilled': 0})
+            open_starts = {str(a) for a, _ in remaining}
+            attempts = {k: v for k, v in entry['attempts'].items() if k in open_starts}
+            for _, _, members in windows:
+                for a, _ in members:
+                    if str(a) in open_starts: attempts[str(a)] = attempts.get(str(a), 0) + 1
+            entry['attempts'] = attempts
+            entry['backfilled'] += filled
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(tmp, self.path)
+
+    def backfilled(self, key):
+        return self.state.get(key, {}).get('backfilled', 0)
+
+
+class SessionManager:
+    """Hält die Portal-Session am Leben und bündelt Re-Logins zu einem einzigen Versuch."""
+
+    def __init__(self, api):
+        self.api = api
+        self.lock = threading.Lock()  # wer hier wartet, übernimmt das Ergebnis des laufenden Logins
+        self.generation = 0
+        self.last_ok = False
+        self.failures = 0
+        self.blocked_until = 0
+        self.verified = 0
+        self.timer = None
+
+    def expires(self):
+        # frühester Ablauf der Cookies mit Ablaufdatum (XSRF, Remember-Me)
+        self.api.session.cookies.clear_expired_cookies()
+        host = urllib.parse.urlparse(DIGIMETO_BASE_URL).hostname
+        stamps = [c.expires for c in self.api.session.cookies if c.expires and c.expires > 0 and host.endswith(c.domain.lstrip('.'))]
+        return min(stamps) if stamps else None
+
+    def _xsrf_valid(self, now):
+        expires = self.expires()
+        return bool(self.api.session.cookies.get('XSRF-TOKEN')) and (expires is None or expires - now > SESSION_REFRESH_MARGIN)
+
+    def touch(self):
+        self.verified = time.time()
+
+    def ensure(self):
+        now = time.time()
+        if now - self.verified < SESSION_VERIFY_TTL and self._xsrf_valid(now):
+            return True
+        generation = self.generation
+        if self._xsrf_valid(now) and self.api._probe_session():
+            logger.debug("Gespeicherte Session ist gültig")
+            self.touch()
+            self.schedule()
+            return True
+        logger.info("Session abgelaufen oder ungültig")
+        return self.relogin(generation)
+
+    def relogin(self, generation):
+        with self.lock:
+            # Login lief bereits, während wir gewartet haben
+            if self.generation != generation: return self.last_ok
+            remaining = self.blocked_until - time.time()
+            if remaining > 0:
+                logger.warning(f"Login pausiert nach {self.failures} Fehlversuch(en), nächster Versuch in {remaining / 60:.0f} min")
+                return False
+            self.last_ok = self.api.login()
+            self.generation += 1
+            if self.last_ok:
+                self.failures, self.blocked_until = 0, 0
+                self.touch()
+            else:
+                self.failures += 1
+                delay = min(LOGIN_BACKOFF_MAX, LOGIN_BACKOFF_BASE * 2 ** (self.failures - 1))
+                self.blocked_until = time.time() + delay
+                logger.error(f"Login fehlgeschlagen, nächster Versuch frühestens in {delay / 60:.0f} min")
+        self.schedule()
+        return self.last_ok
+
+    def _refresh_xsrf(self):
+        self.api.session.get(f"{DIGIMETO_BASE_URL}/analytics/getanalysepage", headers=HTML_HEADERS, timeout=20)
+        self.api._update_xsrf_from_cookie()
+        self.api._save_state()
+
+    def _keepalive(self):
+        try:
+            now = time.time()
+            if now - self.verified >= SESSION_KEEPALIVE - 60 or not self._xsrf_valid(now):
+                generation = self.generation
+                if self.api._probe_session():
+                    if not self._xsrf_valid(now):
+                        logger.debug("XSRF-Token läuft bald ab, erneuere")
+                        self._refresh_xsrf()
+                    self.touch()
+                else:
+                    logger.info("Session im Hintergrund abgelaufen, melde neu an")
+                    self.relogin(generation)
+                    return
+        except Exception as e:
+            logger.debug(f"Session-Keepalive fehlgeschlagen: {e}")
+        self.schedule()
+
+    def schedule(self):
+        # nächste Auffrischung: vor Cookie-Ablauf bzw. vor dem Idle-Timeout der Server-Session
+        now = time.time()
+        due = (self.verified or now) + SESSION_KEEPALIVE
+        expires = self.expires()
+        if expires: due = min(due, expires - SESSION_REFRESH_MARGIN)
+        if self.blocked_until > now: due = max(due, self.blocked_until)
+        if self.timer: self.timer.cancel()
+        self.timer = threading.Timer(max(30, due - now), self._keepalive)
+        self.timer.daemon = True
+        self.timer.start()
+
+
 class DigimetoAPI:
     def __init__(self, username, password):
         self.username = username
         self.password = password
         self.session = requests.Session()
+        # Ein Keep-Alive-Pool für alle parallelen Abrufe
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS * MAX_PARALLEL_METERS)
+        self.session.mount('https://', adapter)
         self.state_file = "/data/digimeto_auth_state.json"
-        self.mp_id1 = None
-        self.mp_id2 = None
+        self.meters = []
+        self.meters_fetched = 0
+        self.latest_interval = {}  # jüngster 15-Minuten-Wert je Zähler (Epoch)
+        self.validators = {}  # ETag / Last-Modified / Hash der letzten Antwort je Reihe
+        self._fresh_validators = {}
+        self._validator_lock = threading.Lock()
+        self.parsed = {}  # letzte aufbereitete Daten je Zähler: (Datum, Daten)
+        self.unchanged = set()  # Zähler ohne neue Daten im letzten Zyklus
+        self.history = HistoryStore(HISTORY_DIR)
+        self.rollup = RollupEngine()
+        self.gaps = GapTracker()
+        self.diagnostics = {}  # je Zähler: fehlende und nachgeladene Slots
+        self.tariff = TariffEngine(TARIFF_HT_PRICE, TARIFF_NT_PRICE, TARIFF_HT_START, TARIFF_HT_END, TARIFF_WEEKEND_NT)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
             'Accept': 'application/json, text/plain, */*',
@@ -48,6 +782,42 @@ class DigimetoAPI:
             'Accept-Language': 'de-DE,de;q=0.9'
         })
         self._load_saved_state()
+        self._load_meters()
+        self._load_validators()
+        self.sessions = SessionManager(self)
+
+    def _load_meters(self):
+        if os.path.exists(METER_REGISTRY_FILE):
+            try:
+                with open(METER_REGISTRY_FILE, 'r') as f:
+                    registry = json.load(f)
+                self.meters, self.meters_fetched = registry.get('meters', []), registry.get('fetched', 0)
+                logger.info(f"{len(self.meters)} Zählpunkt(e) aus Cache geladen.")
+            except Exception as e:
+                logger.warning(f"Zählpunkt-Cache Fehler beim Laden: {e}")
+
+    def _load_validators(self):
+        if os.path.exists(VALIDATOR_FILE):
+            try:
+                with open(VALIDATOR_FILE, 'r') as f:
+                    self.validators = json.load(f)
+            except Exception as e:
+                logger.warning(f"Validatoren nicht lesbar: {e}")
+
+    def _commit_validators(self, keys):
+        # erst nach erfolgreichem Merge übernehmen, sonst würde ein verlorener Abruf als unverändert gelten
+        with self._validator_lock:
+            changed = False
+            for key in keys:
+                tag = self._fresh_validators.pop(key, None)
+                if tag and self.validators.get(key) != tag:
+                    self.validators[key] = tag
+                    changed = True
+            if changed:
+                tmp = VALIDATOR_FILE + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(self.validators, f)
+                os.replace(tmp, VALIDATOR_FILE)
 
     def _load_saved_state(self):
         if os.path.exists(self.state_file):
@@ -85,6 +855,8 @@ class DigimetoAPI:
                 
                 if not isinstance(data, list): return False
 
+                # Kompletten Baum einlesen: jede mp/line-Kombination ist ein eigener Zähler
+                meters = []
                 for root_item in data:
                     if not isinstance(root_item, dict): continue
                     for list_item in root_item.get('childs', []):
@@ -93,90 +865,289 @@ class DigimetoAPI:
                                 m_id = mp.get('id')
                                 for line in mp.get('childs', []):
                                     if line.get('type') == 'line':
-                                        self.mp_id1 = m_id
-                                        self.mp_id2 = line.get('id')
-                                        logger.info(f"Zählpunkt-IDs ermittelt: {self.mp_id1}/{self.mp_id2}")
-                                        return True
+                                        slug = ''.join(c if c.isalnum() else '_' for c in f"{m_id}_{line.get('id')}")
+                                        meters.append({'index': len(meters), 'mp_id1': m_id, 'mp_id2': line.get('id'),
+                                                       'name': mp.get('text') or mp.get('name') or str(m_id), 'slug': slug})
+                if not meters: return False
+                self.meters, self.meters_fetched = meters, time.time()
+                tmp = METER_REGISTRY_FILE + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump({'meters': meters, 'fetched': self.meters_fetched}, f)
+                os.replace(tmp, METER_REGISTRY_FILE)
+                ids = ', '.join(f"{m['mp_id1']}/{m['mp_id2']}" for m in meters)
+                logger.info(f"{len(meters)} Zählpunkt(e) ermittelt: {ids}")
+                return True
             return False
         except Exception as e:
             logger.error(f"Fehler bei ID-Ermittlung: {e}")
             return False
 
+    def _probe_session(self):
+        # Günstiger HTTP-Check der gespeicherten Session, ohne Browser
+        try:
+            url = f"{DIGIMETO_BASE_URL}/sidebarMultiMp/rlm"
+            token = self.session.cookies.get('XSRF-TOKEN')
+            if token: url += f"?ct={urllib.parse.quote(token)}"
+            resp = self.session.get(url, timeout=15, allow_redirects=False)
+            return resp.status_code == 200 and 'json' in resp.headers.get('Content-Type', '')
+        except requests.RequestException as e:
+            logger.debug(f"Session-Check fehlgeschlagen: {e}")
+            return False
+
+    def ensure_session(self):
+        return self.sessions.ensure()
+
+    def _save_state(self):
+        cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'expires': c.expires or -1} for c in self.session.cookies]
+        with open(self.state_file, 'w') as f:
+            json.dump({'cookies': cookies}, f)
+
+    def _http_login(self):
+        # Reiner HTTP-Login über das Symfony-Formular, ohne Browser
+        try:
+            resp = self.session.get(DIGIMETO_LOGIN_URL, headers=HTML_HEADERS, timeout=20)
+            form = _LoginFormParser()
+            form.feed(resp.text)
+            if resp.status_code != 200 or not form.found:
+                logger.info(f"HTTP-Login nicht möglich (Status {resp.status_code}, Formular gefunden: {form.found})")
+                return False
+
+            fields = dict(form.fields, _username=self.username, _password=self.password, _remember_me='on')
+            action = urllib.parse.urljoin(resp.url, form.action or resp.url)
+            resp = self.session.post(action, data=fields, timeout=30, headers={**HTML_HEADERS, 'Referer': resp.url, 'Origin': DIGIMETO_BASE_URL})
+            if resp.status_code != 200 or "/login" in resp.url:
+                logger.info(f"HTTP-Login abgewiesen (Status {resp.status_code})")
+                return False
+
+            # Analyse-Seite setzt das XSRF-Cookie für die API-Aufrufe
+            self.session.get(f"{DIGIMETO_BASE_URL}/analytics/getanalysepage", headers=HTML_HEADERS, timeout=20)
+            self._update_xsrf_from_cookie()
+            if not self._probe_session():
+                logger.info("HTTP-Login ohne gültige Session")
+                return False
+            self._save_state()
+            return True
+        except requests.RequestException as e:
+            logger.info(f"HTTP-Login fehlgeschlagen: {e}")
+            return False
+
     def login(self):
         logger.info("Versuche Login bei Digimeto...")
+        if self._http_login():
+            logger.info("Login erfolgreich (HTTP)!")
+            return True
+        logger.info("Fallback auf Browser-Login")
+        return self._browser_login()
+
+    def _browser_login(self):
         try:
+            # Verwaiste Profil-Locks (z.B. nach Container-Neustart mit neuem Hostnamen) entfernen
+            for name in ('SingletonLock', 'SingletonCookie', 'SingletonSocket'):
+                if os.path.lexists(os.path.join(BROWSER_PROFILE_DIR, name)):
+                    os.remove(os.path.join(BROWSER_PROFILE_DIR, name))
             with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True, args=["--no-sandbox", "--disable-setuid-sandbox"])
-                context = browser.new_context()
-                page = context.new_page()
-                page.goto(DIGIMETO_LOGIN_URL, wait_until="networkidle")
-                page.fill('input[name="_username"]', self.username)
-                page.fill('input[name="_password"]', self.password)
-                page.check('input[name="_remember_me"]')
-                page.click('button[type="submit"]')
-                page.wait_for_function("() => !window.location.href.includes('/login')", timeout=60000)
-                page.goto(f"{DIGIMETO_BASE_URL}/analytics/getanalysepage", wait_until="networkidle")
-                time.sleep(2)
-                state = context.storage_state()
-                with open(self.state_file, 'w') as f:
-                    json.dump(state, f)
-                for cookie in state.get('cookies', []):
-                    self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
-                self._update_xsrf_from_cookie()
-                browser.close()
-                logger.info("Login erfolgreich!")
-                return True
+                context = p.chromium.launch_persistent_context(BROWSER_PROFILE_DIR, headless=True, args=["--no-sandbox", "--disable-setuid-sandbox"])
+                try:
+                    page = context.pages[0] if context.pages else context.new_page()
+                    page.goto(f"{DIGIMETO_BASE_URL}/analytics/getanalysepage", wait_until="domcontentloaded")
+                    # Login-Formular nur, wenn das Remember-Me-Cookie des Profils nicht mehr greift
+                    if "/login" in page.url:
+                        page.fill('input[name="_username"]', self.username)
+                        page.fill('input[name="_password"]', self.password)
+                        page.check('input[name="_remember_me"]')
+                        page.click('button[type="submit"]')
+                        page.wait_for_url(lambda url: "/login" not in url, timeout=60000)
+                        page.goto(f"{DIGIMETO_BASE_URL}/analytics/getanalysepage", wait_until="domcontentloaded")
+                    else:
+                        logger.info("Browser-Profil noch angemeldet, kein Formular nötig")
+                    try:
+                        page.wait_for_function("() => document.cookie.includes('XSRF-TOKEN')", timeout=15000)
+                    except Exception:
+                        logger.debug("XSRF-Cookie nicht im Dokument sichtbar, übernehme vorhandene Cookies")
+                    state = context.storage_state()
+                finally:
+                    context.close()
+            with open(self.state_file, 'w') as f:
+                json.dump(state, f)
+            for cookie in state.get('cookies', []):
+                self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+            self._update_xsrf_from_cookie()
+            logger.info("Login erfolgreich!")
+            return True
         except Exception as e:
             logger.error(f"Login fehlgeschlagen: {e}")
             return False
 
-    def get_meter_data(self):
-        try:
-            if not self.mp_id1 or not self.mp_id2:
-                if not self._fetch_dynamic_ids():
-                    if self.login(): self._fetch_dynamic_ids()
-                    else: return None
+    def _fetch_period(self, meter, p, start_str, end_str, conditional=True):
+        key = HistoryStore.key(meter['mp_id1'], meter['mp_id2'], p)
+        # Validatoren gelten nur für dasselbe Abruffenster
+        known = self.validators.get(key) if conditional else None
+        if not known or known.get('start') != start_str: known = None
+        headers = {}
+        if known and known.get('etag'): headers['If-None-Match'] = known['etag']
+        if known and known.get('last_modified'): headers['If-Modified-Since'] = known['last_modified']
 
-            logger.info("Rufe Zählerdaten ab...")
-            now = datetime.now()
-            start_date = now - timedelta(days=1095)  # 3 Jahre Historie
-            start_str = start_date.strftime("%Y-%m-%dT00:00:00+01:00")
-            end_str = now.strftime("%Y-%m-%dT%H:%M:%S+01:00")
-            
-            periods = ["15mins", "days", "months", "years"]
-            all_raw_data = []
-            
-            for p in periods:
-                url = f"{DIGIMETO_BASE_URL}/data/mpline/genericto/{self.mp_id1}/{self.mp_id2}/{urllib.parse.quote(start_str)}/{urllib.parse.quote(end_str)}/{p}"
-                token = self.session.cookies.get('XSRF-TOKEN')
-                if token: url += f"?ct={urllib.parse.quote(token)}"
-                
-                resp = self.session.get(url, timeout=30)
+        for attempt in range(2):
+            generation = self.sessions.generation
+            url = f"{DIGIMETO_BASE_URL}/data/mpline/genericto/{meter['mp_id1']}/{meter['mp_id2']}/{urllib.parse.quote(start_str)}/{urllib.parse.quote(end_str)}/{p}"
+            token = self.session.cookies.get('XSRF-TOKEN')
+            if token: url += f"?ct={urllib.parse.quote(token)}"
+
+            with self.session.get(url, timeout=30, stream=True, headers=headers) as resp:
                 if resp.status_code == 401 or "/login" in resp.url:
-                    if self.login(): return self.get_meter_data()
-                    return None
-                
+                    if attempt == 0 and self.sessions.relogin(generation): continue
+                    return False
+
+                if resp.status_code == 304:
+                    self.sessions.touch()
+                    logger.debug(f"{p}: unverändert (304)")
+                    return UNCHANGED
+
                 if resp.status_code == 200:
+                    self.sessions.touch()
+                    tag = {'start': start_str, 'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+                    digest = hashlib.sha1()
+                    chunks = resp.iter_content(STREAM_CHUNK_SIZE)
+                    buffered, size = [], 0
+                    for chunk in chunks:
+                        buffered.append(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                        if size > HASH_BUFFER_LIMIT: break
+                    else:
+                        if known and known.get('digest') == digest.hexdigest():
+                            logger.debug(f"{p}: unverändert (Hash)")
+                            return UNCHANGED
+
+                    def body():
+                        yield from buffered
+                        for chunk in chunks:
+                            digest.update(chunk)
+                            yield chunk
                     try:
-                        json_data = resp.json()
-                        json_data['aggregationperiod'] = p
-                        all_raw_data.append(json_data)
-                    except: continue
-            
-            logger.info("Zählerdaten erfolgreich abgerufen")
-            return self.parse_data(all_raw_data)
+                        result = _stream_series(body())
+                    except ValueError as e:
+                        logger.warning(f"Antwort für {p} nicht lesbar: {e}")
+                        return None
+                    tag['digest'] = digest.hexdigest()
+                    if conditional: self._fresh_validators[key] = tag
+                    return result
+                return None
+        return False
+
+    def get_all_meter_data(self):
+        # Alle Zähler parallel mit begrenzter Worker-Anzahl über dieselbe Session abrufen
+        try:
+            self.unchanged.clear()
+            if not self.ensure_session(): return []
+            if not self.meters or time.time() - self.meters_fetched >= METER_REGISTRY_TTL:
+                if not self._fetch_dynamic_ids() and not self.meters: return []
+            with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_METERS, len(self.meters))) as pool:
+                return list(zip(self.meters, pool.map(self.get_meter_data, self.meters)))
         except Exception as e:
             logger.error(f"Fehler beim Datenabruf: {e}")
+            return []
+
+    def get_meter_data(self, meter):
+        try:
+            logger.info(f"Rufe Zählerdaten ab ({meter['name']})...")
+            now = datetime.now(TZ)
+            cold_start = (now - timedelta(days=HISTORY_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0)
+            end_str = _format_ts(now)
+
+            # Im Normalbetrieb nur 15-Minuten-Werte; Tage/Monate/Jahre werden lokal gebildet
+            # und nur zum täglichen Abgleich (oder beim Erstabruf) beim Portal angefragt
+            keys = {p: HistoryStore.key(meter['mp_id1'], meter['mp_id2'], p) for p in PERIODS}
+            due = [p for p in PERIODS if p == '15mins' or not self.history.fetched(keys[p])
+                   or time.time() - self.history.fetched(keys[p]) >= CROSS_CHECK_INTERVAL]
+
+            windows = {}
+            for p in due:
+                high_water = self.history.high_water(keys[p])
+                windows[p] = _window_start(p, _local(high_water)) if high_water else None
+                start_str = _format_ts(windows[p] or cold_start)
+                if windows[p]:
+                    logger.debug(f"Inkrementeller Abruf {p} ab {start_str}")
+                else:
+                    logger.info(f"Erstabruf {p}: lade komplette Historie ab {start_str}")
+
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+                futures = {p: pool.submit(self._fetch_period, meter, p, _format_ts(windows[p] or cold_start), end_str) for p in due}
+                results = {p: f.result() for p, f in futures.items()}
+
+            if any(r is False for r in results.values()):
+                logger.error("Session ungültig, Re-Login fehlgeschlagen")
+                return None
+
+            for p in due:
+                if results[p] is UNCHANGED:
+                    self.history.merge(keys[p], Series(), None)
+                elif results[p]:
+                    meta, series = results[p]
+                    self.history.merge(keys[p], series, meta, windows[p])
+            self._commit_validators(keys.values())
+            filled = self._backfill(meter, keys['15mins'])
+
+            # Portal unverändert und gleicher Tag: letzte Aufbereitung wiederverwenden
+            cached = self.parsed.get(meter['slug'])
+            if not filled and all(results[p] is UNCHANGED for p in due) and cached and cached[0] == now.date():
+                logger.info(f"Keine neuen Daten ({meter['name']})")
+                self.unchanged.add(meter['slug'])
+                return cached[1]
+            results.clear()
+
+            intervals = self.history.series(keys['15mins'])
+            if intervals: self.latest_interval[meter['slug']] = intervals.epochs[-1]
+            for p in due:
+                if p != '15mins': self.rollup.cross_check(p, intervals, self.history.series(keys[p]), now)
+
+            all_raw_data = []
+            for p in PERIODS:
+                entry = self.history.get(keys[p])
+                if p != '15mins':
+                    derived = self.rollup.derive(p, intervals, entry and entry['series'], self.history.fetched(keys[p]), now)
+                    if derived: entry = {**(entry or {}), 'series': derived}
+                if entry: all_raw_data.append({**entry, 'aggregationperiod': p})
+            
+            logger.info(f"Zählerdaten erfolgreich abgerufen ({meter['name']})")
+            parsed = self.parse_data(all_raw_data)
+            if parsed: parsed['diagnostics'] = self.diagnostics.get(meter['slug'], {})
+            if parsed: self.parsed[meter['slug']] = (now.date(), parsed)
+            return parsed
+        except Exception as e:
+            logger.error(f"Fehler beim Datenabruf ({meter['name']}): {e}")
             return None
 
+    def _backfill(self, meter, key):
+        # Nur fehlende Bereiche gezielt nachladen; das jüngste Fenster deckt der reguläre Abruf ab
+        series = self.history.series(key)
+        if not series: return 0
+        gaps = [g for g in GapTracker.find(series) if g[1] < series.epochs[-1] - 2 * 3600]
+        windows = self.gaps.plan(key, gaps)
+        before = len(series)
+        for start, end, members in windows:
+            logger.info(f"Lade {GapTracker.missing(members)} fehlende Werte nach: {_format_ts(_local(start))} bis {_format_ts(_local(end))}")
+            result = self._fetch_period(meter, '15mins', _format_ts(_local(start)), _format_ts(_local(end)), conditional=False)
+            if result and result is not UNCHANGED:
+                meta, incoming = result
+                self.history.merge(key, incoming, meta, _local(start))
+        series = self.history.series(key)
+        remaining = GapTracker.find(series)
+        filled = max(0, len(series) - before)
+        if windows:
+            self.gaps.record(key, windows, remaining, filled)
+            logger.info(f"{filled} Werte nachgeladen, {GapTracker.missing(remaining)} fehlen noch ({meter['name']})")
+        self.diagnostics[meter['slug']] = {'gaps': GapTracker.missing(remaining), 'backfilled': self.gaps.backfilled(key)}
+        return filled
+
     def parse_data(self, raw_data_list):
         try:
-            now = datetime.now()
-            today_str = now.strftime("%Y-%m-%d")
-            current_year = now.year
+            now = datetime.now(TZ)
+            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            year_start = today_start.replace(month=1, day=1)
             
             parsed = {
-                'timestamp': now.isoformat(),
+                'timestamp': now.replace(tzinfo=None).isoformat(),
                 'consumption': {
                     'current': 0, 
                     'today': 0, 
@@ -194,8 +1165,9 @@ class DigimetoAPI:
 
             for data in raw_data_list:
                 p = data.get('aggregationperiod')
-                vals = data.get('values', [])
-                tss = data.get('timestamps', [])
+                series = data.get('series')
+                if not series: continue
+                vals = series.values
 
                 if 'maloId' not in parsed['meter'] and data.get('details'):
                     d = data.get('details', {})
@@ -206,63 +1178,222 @@ class DigimetoAPI:
                         'mq': d.get('mq', '')
                     })
 
-                if p == '15mins' and vals:
+                if p == '15mins':
                     # Aktuelle Leistung in Watt
                     parsed['consumption']['current'] = round(vals[-1] * 4000, 0)
                     
-                    # Heute summieren
-                    t_sum = 0
-                    for ts, val in zip(tss[-150:], vals[-150:]):
-                        if ts.split('T')[0] == today_str: 
-                            t_sum += val
+                    # Heute summieren (lokale Tagesgrenzen, DST-sicher über Epochen)
+                    t_sum = series.window_sum(_epoch(today_start), _epoch(today_start + timedelta(days=1)))
                     parsed['consumption']['today'] = round(t_sum, 3)
 
-                elif p == 'days' and vals:
+                    # Kosten (HT/NT), Leistungsspitzen und Lastdauerlinie
+                    parsed['consumption'].update(self.tariff.evaluate(series, now))
+
+                elif p == 'days':
                     # Letzte 7 Tage
                     for i, val in enumerate(reversed(vals[-7:])):
                         parsed['history']['days'][f'day_{i+1}'] = round(val, 3)
                     parsed['consumption']['days_last'] = round(vals[-1], 3)
                     
                     # Verbrauch im aktuellen Jahr (summiere alle Tage von diesem Jahr)
-                    year_sum = 0
-                    for ts, val in zip(tss, vals):
-                        try:
-                            if ts.split('-')[0] == str(current_year):
-                                year_sum += val
-                        except:
-                            continue
+                    year_sum = series.window_sum(_epoch(year_start), _epoch(year_start.replace(year=year_start.year + 1)))
                     parsed['consumption']['current_year'] = round(year_sum, 3)
 
-                elif p == 'months' and vals:
+                elif p == 'months':
                     # Letzte 13 Monate
                     for i, val in enumerate(reversed(vals[-13:])):
                         parsed['history']['months'][f'month_{i+1}'] = round(val, 3)
 
-                elif p == 'years' and vals and tss:
+                elif p == 'years':
                     # Gesamtzählerstand (letzter Jahreswert)
                     parsed['meter']['reading'] = round(vals[-1], 3)
                     parsed['consumption']['years_last'] = round(vals[-1], 3)
                     
                     # Letzte 3 Jahre - FESTE Keys: year_1, year_2, year_3
                     # year_1 = aktuelles/letztes Jahr, year_2 = vorletztes Jahr, year_3 = vor 3 Jahren
-                    for i, (ts, val) in enumerate(zip(reversed(tss[-3:]), reversed(vals[-3:]))):
-                        try:
-                            year = ts.split('-')[0]  # Jahr für Display-Name
-                            parsed['history']['years'][f'year_{i+1}'] = {
-                                'value': round(val, 3),
-                                'year': year  # Jahr als Metadaten für Display
-                            }
-                        except:
-                            # Fallback ohne Jahr-Parsing
-                            parsed['history']['years'][f'year_{i+1}'] = {
-                                'value': round(val, 3),
-                                'year': 'unbekannt'
-                            }
+                    for i, (epoch, val) in enumerate(zip(reversed(series.epochs[-3:]), reversed(vals[-3:]))):
+                        parsed['history']['years'][f'year_{i+1}'] = {
+                            'value': round(val, 3),
+                            'year': str(_local(epoch).year)  # Jahr als Metadaten für Display
+                        }
 
             return parsed
         except Exception as e:
             logger.error(f"Parse Fehler: {e}"); return None
 
+class StatisticsImporter:
+    """Importiert stündliche Summen der 15-Minuten-Werte als externe Langzeitstatistik in Home Assistant."""
+
+    def __init__(self, url, token, state_file=STATISTICS_STATE_FILE):
+        self.url = url
+        self.token = token
+        self.state_file = state_file
+        self.state = {}
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, 'r') as f:
+                    self.state = json.load(f)
+            except Exception as e:
+                logger.warning(f"Statistik-Status nicht lesbar, importiere vollständig: {e}")
+
+    @staticmethod
+    def statistic_id(meter):
+        if meter['index'] == 0: return "digimeto:energy_consumption"
+        return f"digimeto:energy_consumption_{meter['slug'].lower()}"
+
+    @staticmethod
+    def hourly(series):
+        # [(Stundenbeginn, kumulierte Summe)] nur für vollständig abgedeckte Stunden
+        hours = []
+        if not series: return hours
+        end = series.epochs[-1] + INTERVAL_SECONDS
+        total = 0.0
+        i, n = 0, len(series)
+        while i < n:
+            hour = series.epochs[i] - series.epochs[i] % 3600
+            j = series.index(hour + 3600)
+            if hour + 3600 > end: break
+            total += math.fsum(series.values[i:j])
+            hours.append((hour, total))
+            i = j
+        return hours
+
+    def _save(self):
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_file)
+
+    def _call(self, ws, payload):
+        self._id += 1
+        ws.send(json.dumps({'id': self._id, **payload}))
+        while True:
+            msg = json.loads(ws.recv())
+            if msg.get('id') == self._id and msg.get('type') == 'result':
+                if not msg.get('success'): raise RuntimeError(msg.get('error', {}).get('message', 'unbekannter Fehler'))
+                return msg.get('result')
+
+    def _connect(self):
+        ws = websocket.create_connection(self.url, timeout=30)
+        msg = json.loads(ws.recv())
+        if msg.get('type') == 'auth_required':
+            ws.send(json.dumps({'type': 'auth', 'access_token': self.token}))
+            msg = json.loads(ws.recv())
+        if msg.get('type') != 'auth_ok':
+            ws.close()
+            raise RuntimeError(f"Authentifizierung abgelehnt: {msg.get('message', msg.get('type'))}")
+        self._id = 0
+        return ws
+
+    def sync(self, meter, series, unit='kWh'):
+        sid = self.statistic_id(meter)
+        hours = self.hourly(series)
+        if not hours: return
+        known = self.state.get(sid, {})
+        if known.get('last') == list(hours[-1]): return
+
+        # Ab dem gespeicherten Stützpunkt weitermachen, solange die Historie davor unverändert ist
+        start = 0
+        if known.get('checkpoint'):
+            hour, total = known['checkpoint']
+            i = bisect_left(hours, (hour, float('-inf')))
+            if i < len(hours) and hours[i][0] == hour and abs(hours[i][1] - total) < 1e-6:
+                start = i + 1
+            else:
+                logger.info(f"Historie vor dem letzten Statistik-Import geändert, importiere {sid} vollständig")
+
+        metadata = {'has_mean': False, 'has_sum': True, 'name': f"Digimeto {meter['name']}",
+                    'source': 'digimeto', 'statistic_id': sid, 'unit_of_measurement': unit}
+        pending = hours[start:]
+        ws = self._connect()
+        try:
+            for b in range(0, len(pending), STATISTICS_BATCH):
+                stats = [{'start': datetime.fromtimestamp(h, ZoneInfo('UTC')).isoformat(), 'sum': round(total, 4)}
+                         for h, total in pending[b:b + STATISTICS_BATCH]]
+                self._call(ws, {'type': 'recorder/import_statistics', 'metadata': metadata, 'stats': stats})
+        finally:
+            ws.close()
+
+        c = bisect_left(hours, (hours[-1][0] - STATISTICS_OVERLAP, float('-inf'))) - 1
+        self.state[sid] = {'last': list(hours[-1]), 'checkpoint': list(hours[c]) if c >= 0 else None}
+        self._save()
+        logger.info(f"{len(pending)} Stundenwerte in Langzeitstatistik {sid} importiert")
+
+
+class DiscoveryRegistry:
+    # Hält die aktuellen Discovery-Configs; publiziert nur geänderte, nach einer HA-Birth-Message alle
+    def __init__(self, publisher):
+        self.publisher = publisher
+        self.configs = {}
+        self.lock = threading.Lock()
+
+    def update(self, configs):
+        with self.lock:
+            self.configs.update({topic: json.dumps(c) for topic, c in configs.items()})
+            sent = sum(self.publisher._publish(topic, self.configs[topic]) for topic in configs)
+        if sent: logger.info(f"{sent} Discovery-Configs aktualisiert")
+        return sent
+
+    def republish(self):
+        with self.lock:
+            for topic, payload in self.configs.items():
+                self.publisher._publish(topic, payload, force=True)
+        logger.info(f"Home Assistant online: {len(self.configs)} Discovery-Configs erneut publiziert")
+
+
+class OutboundQueue:
+    """Persistente Warteschlange für retained Topics; je Topic wird nur der letzte Wert gehalten."""
+
+    def __init__(self, path, limit=MQTT_QUEUE_LIMIT):
+        self.path, self.limit = path, limit
+        self.items = {}  # Reihenfolge = letzte Aktualisierung
+        self.lock = threading.Lock()
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.items = dict(json.load(f))
+                if self.items: logger.info(f"{len(self.items)} gepufferte MQTT-Nachrichten geladen")
+            except Exception as e:
+                logger.warning(f"MQTT-Warteschlange nicht lesbar: {e}")
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, topic, payload):
+        with self.lock:
+            self.items.pop(topic, None)
+            self.items[topic] = payload
+            while len(self.items) > self.limit:
+                dropped = next(iter(self.items))
+                del self.items[dropped]
+                logger.warning(f"MQTT-Warteschlange voll, verwerfe {dropped}")
+            self.dirty = True
+
+    def peek(self):
+        with self.lock:
+            return next(iter(self.items.items()), None)
+
+    def done(self, topic, payload):
+        # nur entfernen, wenn inzwischen kein neuerer Wert eingereiht wurde
+        with self.lock:
+            if self.items.get(topic) == payload:
+                del self.items[topic]
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty: return
+            items, self.dirty = list(self.items.items()), False
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(items, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"MQTT-Warteschlange Fehler beim Speichern: {e}")
+
+
 class MQTTPublisher:
     def __init__(self, host, port, username, password, topic_prefix):
         self.host, self.port, self.topic_prefix = host, port, topic_prefix
@@ -272,78 +1403,199 @@ class MQTTPublisher:
         if username and password: self.client.username_pw_set(username, password)
         # Callback für VERSION2 angepasst
         self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.on_disconnect = self._on_disconnect
+        self.client.reconnect_delay_set(min_delay=1, max_delay=MQTT_RECONNECT_MAX)
+        # Alle Nachrichten laufen über die Warteschlange, ein Thread sendet sie gedrosselt
+        self.queue = OutboundQueue(MQTT_QUEUE_FILE)
+        self._wake = threading.Event()
+        threading.Thread(target=self._drain, name="mqtt-drain", daemon=True).start()
+        self.discovery = DiscoveryRegistry(self)
+        self._lock = threading.RLock()
+        # Digest des zuletzt gesendeten Payloads je Topic (übersteht Neustarts)
+        self.digests = {}
+        self.last_full_refresh = {}  # je Topic-Präfix
+        self._load_digests()
+
+    def _load_digests(self):
+        if os.path.exists(DIGEST_FILE):
+            try:
+                with open(DIGEST_FILE, 'r') as f:
+                    state = json.load(f)
+                self.digests = state.get('digests', {})
+                if isinstance(state.get('last_full_refresh'), dict): self.last_full_refresh = state['last_full_refresh']
+            except Exception as e:
+                logger.warning(f"MQTT-Digest Fehler beim Laden: {e}")
+
+    def _save_digests(self):
+        try:
+            tmp = f"{DIGEST_FILE}.tmp"
+            with self._lock, open(tmp, 'w') as f:
+                json.dump({'digests': self.digests, 'last_full_refresh': self.last_full_refresh}, f)
+            os.replace(tmp, DIGEST_FILE)
+        except Exception as e:
+            logger.warning(f"MQTT-Digest Fehler beim Speichern: {e}")
+
+    def _publish(self, topic, payload, force=False, content=None):
+        # Nur senden, wenn sich der Inhalt seit dem letzten Senden geändert hat
+        digest = hashlib.sha1((payload if content is None else content).encode()).hexdigest()
+        with self._lock:
+            if not force and self.digests.get(topic) == digest: return False
+            self.queue.put(topic, payload)
+            self.digests[topic] = digest
+        self._wake.set()
+        return True
+
+    def _drain(self):
+        while True:
+            self._wake.wait(5)
+            self._wake.clear()
+            sent = 0
+            while self.connected:
+                item = self.queue.peek()
+                if not item: break
+                topic, payload = item
+                try:
+                    info = self.client.publish(topic, payload, qos=1, retain=True)
+                    info.wait_for_publish(10)
+                    if not info.is_published(): break
+                except Exception as e:
+                    logger.debug(f"MQTT Senden unterbrochen: {e}")
+                    break
+                self.queue.done(topic, payload)
+                sent += 1
+                time.sleep(1 / MQTT_DRAIN_RATE)
+            self.queue.save()
+            if sent: logger.debug(f"{sent} Nachrichten aus der Warteschlange gesendet, {len(self.queue)} ausstehend")
 
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:
             self.connected = True
+            if len(self.queue): logger.info(f"MQTT verbunden, sende {len(self.queue)} gepufferte Nachrichten")
+            self._wake.set()
+            # Home Assistant Birth-Message: nach einem HA-Neustart Discovery erneut senden
+            client.subscribe(HA_STATUS_TOPIC)
         else:
             logger.error(f"MQTT Verbindungsfehler: {reason_code}")
 
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.connected = False
+        if reason_code != 0: logger.warning(f"MQTT Verbindung getrennt ({reason_code}), Nachrichten werden gepuffert")
+
+    def _on_message(self, client, userdata, msg):
+        if msg.topic == HA_STATUS_TOPIC and msg.payload.decode(errors='ignore').strip() == 'online':
+            self.discovery.republish()
+            self._save_digests()
+
     def connect(self):
+        # Verbindungsaufbau und Reconnects (mit Backoff) übernimmt der paho-Loop
         try:
-            self.client.connect(self.host, self.port, 60)
+            self.client.connect_async(self.host, self.port, 60)
             self.client.loop_start()
-            for _ in range(50):
-                if self.connected: return True
-                time.sleep(0.1)
+        except Exception as e:
+            logger.error(f"MQTT Verbindungsfehler: {e}")
             return False
-        except: return False
+        for _ in range(50):
+            if self.connected: return True
+            time.sleep(0.1)
+        return False
+
+    def _target(self, meter):
+        # Erster Zähler behält die bisherigen Topics/IDs, weitere bekommen eigenes Präfix und eigenes Gerät
+        if not meter or meter.get('index', 0) == 0:
+            dev = {"identifiers": ["digimeto"], "name": "Digimeto Zähler", "manufacturer": "Digimeto"}
+            return self.topic_prefix, "digimeto", "dg", dev
+        slug = meter['slug']
+        dev = {"identifiers": [f"digimeto_{slug}"], "name": f"Digimeto Zähler {meter.get('name') or slug}", "manufacturer": "Digimeto"}
+        return f"{self.topic_prefix}/{slug}", f"digimeto_{slug}", f"dg_{slug}", dev
 
-    def publish_data(self, data):
-        if not self.connected and not self.connect(): return False
+    def publish_data(self, data, meter=None):
         try:
-            self.client.publish(f"{self.topic_prefix}/data", json.dumps(data), retain=True)
-            for sec in ['consumption', 'meter']:
+            prefix = self._target(meter)[0]
+            full = time.time() - self.last_full_refresh.get(prefix, 0) >= FULL_REFRESH_HOURS * 3600
+            messages = []
+            # Zeitstempel zählt nicht als Änderung des Daten-Blobs
+            content = json.dumps({k: v for k, v in data.items() if k != 'timestamp'}, sort_keys=True)
+            messages.append((f"{prefix}/data", json.dumps(data), content))
+            for sec in ['consumption', 'meter', 'diagnostics']:
                 for k, v in data.get(sec, {}).items():
-                    self.client.publish(f"{self.topic_prefix}/{sec}/{k}", str(v), retain=True)
+                    messages.append((f"{prefix}/{sec}/{k}", str(v), None))
             # Publiziere Tage und Monate
             for p in ['days', 'months']:
                 for k, v in data.get('history', {}).get(p, {}).items():
-                    self.client.publish(f"{self.topic_prefix}/history/{p}/{k}", str(v), retain=True)
+                    messages.append((f"{prefix}/history/{p}/{k}", str(v), None))
             # Publiziere Jahre (extrahiere Wert aus Dict)
             for k, v_dict in data.get('history', {}).get('years', {}).items():
                 if isinstance(v_dict, dict):
-                    self.client.publish(f"{self.topic_prefix}/history/years/{k}", str(v_dict['value']), retain=True)
+                    messages.append((f"{prefix}/history/years/{k}", str(v_dict['value']), None))
                 else:
-                    self.client.publish(f"{self.topic_prefix}/history/years/{k}", str(v_dict), retain=True)
-            self.publish_discovery_config(data)
+                    messages.append((f"{prefix}/history/years/{k}", str(v_dict), None))
+
+            sent = sum(self._publish(topic, payload, full, content) for topic, payload, content in messages)
+            if full: self.last_full_refresh[prefix] = time.time()
+            logger.info(f"{sent} von {len(messages)} Topics publiziert{' (Voll-Refresh)' if full else ''}")
+            self.publish_discovery_config(data, meter)
+            self._save_digests()
+            self.queue.save()
             return True
         except Exception as e:
             logger.error(f"MQTT Publish Fehler: {e}"); return False
 
-    def publish_discovery_config(self, data):
+    def publish_discovery_config(self, data, meter=None):
         try:
             now = datetime.now()
-            dev = {"identifiers": ["digimeto"], "name": "Digimeto Zähler", "manufacturer": "Digimeto"}
+            prefix, node, uid, dev = self._target(meter)
             wt = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
             mn = ["Januar", "Februar", "März", "April", "Mai", "Juni", "Juli", "August", "September", "Oktober", "November", "Dezember"]
+            configs = {}
 
             metrics = {
                 "today": ["Verbrauch Heute", "kWh", "energy", "total_increasing"],
                 "current_year": ["Verbrauch Aktuelles Jahr", "kWh", "energy", "total_increasing"],
+                "peak_current_month": ["Leistungsspitze Aktueller Monat", "kW", "power", "measurement"],
+                "peak_last_month": ["Leistungsspitze Letzter Monat", "kW", "power", "measurement"],
+                "load_p50": ["Last Median (12 Monate)", "kW", "power", "measurement"],
+                "load_p90": ["Last 90%-Perzentil (12 Monate)", "kW", "power", "measurement"],
+                "load_p99": ["Last 99%-Perzentil (12 Monate)", "kW", "power", "measurement"],
                 "maloId": ["Marktlokation ID", None, None, None],
                 "metpoint": ["Messstellenbezeichnung", None, None, None],
                 "mq": ["Zähler OBIS Code", None, None, None]
             }
             
+            if 'cost_today' in data.get('consumption', {}):
+                metrics.update({
+                    "cost_today": ["Kosten Heute", "EUR", "monetary", "total"],
+                    "cost_current_month": ["Kosten Aktueller Monat", "EUR", "monetary", "total"],
+                    "cost_current_year": ["Kosten Aktuelles Jahr", "EUR", "monetary", "total"],
+                })
+
             for k, info in metrics.items():
                 t = "meter" if k in ["maloId", "metpoint", "mq"] else "consumption"
-                c = {"name": info[0], "default_entity_id": f"sensor.digimeto_{k}", "unique_id": f"dg_{k}", "state_topic": f"{self.topic_prefix}/{t}/{k}", "device": dev}
+                c = {"name": info[0], "default_entity_id": f"sensor.{node}_{k}", "unique_id": f"{uid}_{k}", "state_topic": f"{prefix}/{t}/{k}", "device": dev}
                 if info[1]: c["unit_of_measurement"] = info[1]
                 if info[2]: c["device_class"] = info[2]
                 if info[3]: c["state_class"] = info[3]
-                self.client.publish(f"homeassistant/sensor/digimeto/{k}/config", json.dumps(c), retain=True)
+                configs[f"homeassistant/sensor/{node}/{k}/config"] = c
+
+            diagnostics = {
+                "gaps": ["Fehlende Viertelstundenwerte", "mdi:timeline-alert-outline"],
+                "backfilled": ["Nachgeladene Viertelstundenwerte", "mdi:timeline-check-outline"],
+            }
+            for k, (name, icon) in diagnostics.items():
+                c = {"name": name, "default_entity_id": f"sensor.{node}_{k}", "unique_id": f"{uid}_{k}", "state_topic": f"{prefix}/diagnostics/{k}",
+                     "icon": icon, "state_class": "measurement", "entity_category": "diagnostic", "device": dev}
+                configs[f"homeassistant/sensor/{node}/{k}/config"] = c
 
             for i in range(1, 8):
                 d_t = now - timedelta(days=i)
-                c = {"name": f"Verbrauch {wt[d_t.weekday()]} ({d_t.strftime('%d.%m.')})", "default_entity_id": f"sensor.digimeto_day_{i}", "unique_id": f"dg_day_{i}", "state_topic": f"{self.topic_prefix}/history/days/day_{i}", "unit_of_measurement": "kWh", "device_class": "energy", "state_class": "total", "device": dev}
-                self.client.publish(f"homeassistant/sensor/digimeto/day_{i}/config", json.dumps(c), retain=True)
+                c = {"name": f"Verbrauch {wt[d_t.weekday()]} ({d_t.strftime('%d.%m.')})", "default_entity_id": f"sensor.{node}_day_{i}", "unique_id": f"{uid}_day_{i}", "state_topic": f"{prefix}/history/days/day_{i}", "unit_of_measurement": "kWh", "device_class": "energy", "state_class": "total", "device": dev}
+                configs[f"homeassistant/sensor/{node}/day_{i}/config"] = c
 
             for i in range(1, 14):
                 month = (now.month - 1 - i) % 12  # 0-basiert, zuverlässig ohne timedelta-Drift
                 year = now.year + (now.month - 1 - i) // 12
-                c = {"name": f"Verbrauch {mn[month]} {year}", "default_entity_id": f"sensor.digimeto_mon_{i}", "unique_id": f"dg_mon_{i}", "state_topic": f"{self.topic_prefix}/history/months/month_{i}", "unit_of_measurement": "kWh", "device_class": "energy", "state_class": "total", "device": dev}
-                self.client.publish(f"homeassistant/sensor/digimeto/mon_{i}/config", json.dumps(c), retain=True)
+                c = {"name": f"Verbrauch {mn[month]} {year}", "default_entity_id": f"sensor.{node}_mon_{i}", "unique_id": f"{uid}_mon_{i}", "state_topic": f"{prefix}/history/months/month_{i}", "unit_of_measurement": "kWh", "device_class": "energy", "state_class": "total", "device": dev}
+                configs[f"homeassistant/sensor/{node}/mon_{i}/config"] = c
             
             # Letzte 3 Jahre - FESTE Entitäten mit dynamischen Namen aus den Daten
             years_data = data.get('history', {}).get('years', {})
@@ -358,34 +1610,142 @@ class MQTTPublisher:
                     year_str = f'Jahr -{year_num-1}'
                 
                 # Jahr 1 = aktuelles/letztes, Jahr 2 = vorletztes, etc.
-                c = {"name": f"Verbrauch Jahr {year_str}", "default_entity_id": f"sensor.digimeto_year_{year_num}", "unique_id": f"dg_year_{year_num}", "state_topic": f"{self.topic_prefix}/history/years/{year_key}", "unit_of_measurement": "kWh", "device_class": "energy", "state_class": "total_increasing", "device": dev}
-                self.client.publish(f"homeassistant/sensor/digimeto/year_{year_num}/config", json.dumps(c), retain=True)
+                c = {"name": f"Verbrauch Jahr {year_str}", "default_entity_id": f"sensor.{node}_year_{year_num}", "unique_id": f"{uid}_year_{year_num}", "state_topic": f"{prefix}/history/years/{year_key}", "unit_of_measurement": "kWh", "device_class": "energy", "state_class": "total_increasing", "device": dev}
+                configs[f"homeassistant/sensor/{node}/year_{year_num}/config"] = c
+
+            # Nur geänderte Configs gehen raus (z.B. neue Tages-/Monatsnamen nach dem Wechsel)
+            self.discovery.update(configs)
         except Exception as e: logger.error(f"Discovery Fehler: {e}")
 
+class Scheduler:
+    """Taktet die Abrufe an Wall-Clock-Grenzen und lernt, wann das Portal neue Werte liefert."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.newest = None  # Beginn des jüngsten bekannten 15-Minuten-Intervalls
+        self.step = None    # typischer Vorschub pro Veröffentlichung (s)
+        self.lag = None     # Verzögerung zwischen Intervallende und Verfügbarkeit (s)
+        self.failures = 0
+        self.missed = None  # letzter Abruf, bei dem fällige Daten noch fehlten
+        self.blind = False  # Fehler seit dem letzten Erfolg: Abrufzeit sagt nichts über die Verzögerung
+
+    def _aligned(self, now):
+        # nächste Grenze in lokaler Zeit, z.B. volle Stunde bei 3600 s
+        offset = _local(now).utcoffset().total_seconds()
+        return (math.floor((now + offset) / self.interval) + 1) * self.interval - offset
+
+    def _backoff(self):
+        delay = min(RETRY_MAX, RETRY_BASE * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _expected(self):
+        if self.newest is None or self.step is None or self.lag is None: return None
+        return self.newest + INTERVAL_SECONDS + self.step + self.lag
+
+    def _learn_lag(self, newest, started):
+        end = newest + INTERVAL_SECONDS
+        if self.missed is not None:
+            # Veröffentlichung lag zwischen dem letzten Fehlversuch und diesem Abruf
+            lag = (self.missed + started) / 2 - end
+        else:
+            # Planmäßiger Abruf POLL_MARGIN nach der Erwartung: den Versatz abziehen und eine weitere
+            # Marge darunter ansetzen, damit die Verzögerung sinken kann, bis ein Abruf zu früh kommt
+            lag = started - end - 2 * POLL_MARGIN
+        lag = max(0, lag)
+        self.lag = lag if self.lag is None else self.lag + LAG_ALPHA * (lag - self.lag)
+
+    def observe(self, ok, newest, started):
+        if not ok:
+            self.failures += 1
+            self.blind = True
+            return
+        if newest is not None and (self.newest is None or newest > self.newest):
+            if self.newest is not None:
+                step = newest - self.newest
+                self.step = step if self.step is None else self.step + LAG_ALPHA * (step - self.step)
+                if not self.blind: self._learn_lag(newest, started)
+                if self.lag is not None:
+                    logger.debug(f"Portal-Verzögerung {self.lag / 60:.0f} min, Vorschub {self.step / 60:.0f} min")
+            self.newest = newest
+            self.failures, self.missed, self.blind = 0, None, False
+        elif self._expected() is not None and started >= self._expected():
+            # Daten waren fällig, sind aber noch nicht da
+            self.failures += 1
+            self.missed = started
+        else:
+            self.failures = 0
+
+    def next_run(self, now):
+        if self.failures:
+            target = now + self._backoff()
+            expected = self._expected()
+            if expected is None or expected <= now: return min(target, now + RETRY_MAX)
+            return min(target, expected + POLL_MARGIN)
+        expected = self._expected()
+        if expected is None: return self._aligned(now)
+        # erste erwartete Veröffentlichung, die das Intervall nicht unterschreitet
+        earliest = now + max(RETRY_BASE, self.interval - self.step)
+        if expected < earliest:
+            expected += math.ceil((earliest - expected) / max(self.step, INTERVAL_SECONDS)) * max(self.step, INTERVAL_SECONDS)
+        return expected + POLL_MARGIN
+
+    def run(self, cycle):
+        # Zyklen laufen synchron in dieser Schleife: der nächste Termin wird erst nach dem
+        # Ende des vorherigen berechnet, Überlappungen sind damit ausgeschlossen
+        while True:
+            started = time.time()
+            try:
+                ok, newest = cycle()
+            except Exception as e:
+                logger.error(f"Fehler im Abrufzyklus: {e}")
+                ok, newest = False, None
+            self.observe(ok, newest, started)
+            target = self.next_run(time.time())
+            logger.info(f"Nächstes Update um {_local(target).strftime('%H:%M:%S')} "
+                        f"(in {max(0, target - time.time()):.0f} Sekunden)")
+            # auf absoluten Zeitpunkt schlafen, damit sich die Zyklusdauer nicht aufsummiert
+            while (remaining := target - time.time()) > 0:
+                time.sleep(min(remaining, 60))
+
+
 def main():
     logger.info("=== Digimeto MQTT Bridge gestartet ===")
     api = DigimetoAPI(DIGIMETO_USERNAME, DIGIMETO_PASSWORD)
     mqtt_p = MQTTPublisher(MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_TOPIC_PREFIX)
     
     logger.info(f"Verbinde mit MQTT Broker {MQTT_HOST}:{MQTT_PORT}...")
-    if not mqtt_p.connect(): 
-        logger.error("MQTT Verbindung fehlgeschlagen!")
-        sys.exit(1)
-    logger.info("MQTT verbunden")
+    if mqtt_p.connect():
+        logger.info("MQTT verbunden")
+    else:
+        logger.warning("MQTT noch nicht erreichbar, Daten werden gepuffert und nach dem Verbinden gesendet")
     
     logger.info(f"Update-Intervall: {UPDATE_INTERVAL} Sekunden")
-    
-    while True:
-        data = api.get_meter_data()
-        if data: 
-            mqtt_p.publish_data(data)
-            logger.info("Daten an MQTT publiziert")
-        else:
+    importer = StatisticsImporter(HA_WEBSOCKET_URL, SUPERVISOR_TOKEN) if IMPORT_STATISTICS and SUPERVISOR_TOKEN else None
+
+    def cycle():
+        results = api.get_all_meter_data()
+        for meter, data in results:
+            if data and meter['slug'] in api.unchanged:
+                logger.debug(f"Unverändert, keine Veröffentlichung ({meter['name']})")
+            elif data: 
+                mqtt_p.publish_data(data, meter)
+                logger.info(f"Daten an MQTT publiziert ({meter['name']})")
+            else:
+                logger.warning(f"Keine Daten empfangen ({meter['name']})")
+        if not results:
             logger.warning("Keine Daten empfangen")
-        
-        logger.info(f"Nächstes Update in {UPDATE_INTERVAL} Sekunden...")
-        time.sleep(UPDATE_INTERVAL)
+        if importer:
+            for meter, data in results:
+                if not data or meter['slug'] in api.unchanged: continue
+                try:
+                    importer.sync(meter, api.history.series(HistoryStore.key(meter['mp_id1'], meter['mp_id2'], '15mins')),
+                                  data['meter'].get('unit') or 'kWh')
+                except Exception as e:
+                    logger.warning(f"Statistik-Import fehlgeschlagen ({meter['name']}): {e}")
+        newest = max(api.latest_interval.values(), default=None)
+        return any(data for _, data in results), newest
+
+    Scheduler(UPDATE_INTERVAL).run(cycle)
 
 if __name__ == "__main__":
     main()
-
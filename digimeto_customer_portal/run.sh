@@ -16,6 +16,14 @@ export MQTT_USERNAME=$(jq --raw-output '.mqtt_username // empty' $CONFIG_PATH)
 export MQTT_PASSWORD=$(jq --raw-output '.mqtt_password // empty' $CONFIG_PATH)
 export MQTT_TOPIC_PREFIX=$(jq --raw-output '.mqtt_topic_prefix // "digimeto"' $CONFIG_PATH)
 export UPDATE_INTERVAL=$(jq --raw-output '.update_interval // 3600' $CONFIG_PATH)
+export FULL_REFRESH_HOURS=$(jq --raw-output '.full_refresh_hours // 24' $CONFIG_PATH)
+export MAX_PARALLEL_METERS=$(jq --raw-output '.max_parallel_meters // 4' $CONFIG_PATH)
+export IMPORT_STATISTICS=$(jq --raw-output 'if .import_statistics == false then "false" else "true" end' $CONFIG_PATH)
+export TARIFF_HT_PRICE=$(jq --raw-output '.tariff_ht_price // 0' $CONFIG_PATH)
+export TARIFF_NT_PRICE=$(jq --raw-output '.tariff_nt_price // 0' $CONFIG_PATH)
+export TARIFF_HT_START=$(jq --raw-output '.tariff_ht_start // "06:00"' $CONFIG_PATH)
+export TARIFF_HT_END=$(jq --raw-output '.tariff_ht_end // "22:00"' $CONFIG_PATH)
+export TARIFF_WEEKEND_NT=$(jq --raw-output 'if .tariff_weekend_nt == false then "false" else "true" end' $CONFIG_PATH)
 export LOG_LEVEL=$(jq --raw-output '.log_level // "info"' $CONFIG_PATH)
 
 # Wechsle in /data, damit die Datei digimeto_auth_state.json 
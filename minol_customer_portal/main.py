@@ -3,6 +3,8 @@ import json
 import os
 import logging
 import sys
+import queue
+import threading
 import paho.mqtt.client as mqtt
 from datetime import datetime
 from minol_connector import MinolConnector
@@ -47,7 +49,16 @@ def connect_mqtt():
     except Exception as e:
         logger.error(f"MQTT Fehler: {e}"); sys.exit(1)
 
-def publish_discovery_config(sensor_type, unique_id, name, unit, icon, device_class, state_class=None, attributes_topic=None):
+LEGACY_DEVICE = {"identifiers": ["minol_account"], "name": "Minol Customer Portal", "manufacturer": "Minol"}
+
+def tenant_device(tenant):
+    # Erster Mieter behält das bisherige Gerät, weitere bekommen ein eigenes
+    if tenant["index"] == 0: return LEGACY_DEVICE
+    info = tenant.get("info") or {}
+    label = f"{info.get('addrStreet','')} {info.get('addrHouseNum','')}".strip() or str(tenant["user_num"])
+    return {"identifiers": [f"minol_{tenant['slug']}"], "name": f"Minol {label} ({tenant['user_num']})", "manufacturer": "Minol"}
+
+def publish_discovery_config(sensor_type, unique_id, name, unit, icon, device_class, state_class=None, attributes_topic=None, device=None):
     topic = f"homeassistant/sensor/minol/{unique_id}/config"
     payload = {
         "name": name,
@@ -57,7 +68,7 @@ def publish_discovery_config(sensor_type, unique_id, name, unit, icon, device_cl
         "device_class": device_class,
         "icon": icon,
         "platform": "mqtt",
-        "device": {"identifiers": ["minol_account"], "name": "Minol Customer Portal", "manufacturer": "Minol"}
+        "device": device or LEGACY_DEVICE
     }
     if state_class: payload["state_class"] = state_class
     if attributes_topic: payload["json_attributes_topic"] = attributes_topic
@@ -69,24 +80,88 @@ def publish_state(unique_id, value):
 def publish_attributes(unique_id, attributes):
     mqtt_client.publish(f"minol/{unique_id}/attributes", json.dumps(attributes), qos=0, retain=True)
 
+# Langlebiger Connector: Cookies liegen in /data, Browser-Login nur wenn die Session ungültig ist
+connector = MinolConnector(config["minol_email"], config["minol_password"], config["base_url"],
+                           billing_start_month=config.get("billing_start_month", 9))
+
+# Größe der Queues zwischen den Pipeline-Stufen
+PIPELINE_QUEUE_SIZE = 4
+
+CATEGORIES = {
+    "heating": ("Heizung", "kWh", "mdi:radiator", "energy"),
+    "hot_water": ("Warmwasser", "m³", "mdi:water-thermometer", "water"),
+    "cold_water": ("Kaltwasser", "m³", "mdi:water-pump", "water")
+}
+
 def run_sync():
-    connector = MinolConnector(config["minol_email"], config["minol_password"], config["base_url"])
     logger.info("Starte Synchronisierung...")
-    connector.login()
-    if not getattr(connector, "_authenticated", False): return
-
-    connector.get_user_tenants()
-    data = connector.get_consumption_data(months_back=24, force_update=True)
-    if not data: return
+    if not connector.authenticate(): return
+
+    # Pipeline: Abruf → Aufbereitung → Veröffentlichung, verbunden über begrenzte Queues.
+    # Jede Kategorie wird veröffentlicht, sobald ihre readData-Antwort da ist.
+    raw_q, processed_q = queue.Queue(PIPELINE_QUEUE_SIZE), queue.Queue(PIPELINE_QUEUE_SIZE)
+
+    def fetch_stage():
+        try:
+            for item in connector.iter_em_data(months_back=24):
+                raw_q.put(item)
+        except Exception as e:
+            logger.error(f"Fehler beim Abruf: {e}")
+        finally:
+            raw_q.put(None)
+
+    def process_stage():
+        while (item := raw_q.get()) is not None:
+            raw = item.pop("raw")  # Rohantwort nach der Aufbereitung freigeben
+            item["data"] = None
+            if raw is not None:
+                try:
+                    item["data"] = connector._process_consumption_data(raw, item["type"], item["start"], item["end"])
+                except Exception as e:
+                    logger.error(f"Fehler bei der Aufbereitung ({item['key']}): {e}")
+            processed_q.put(item)
+        processed_q.put(None)
+
+    stages = [threading.Thread(target=fetch_stage, name="minol-fetch", daemon=True),
+              threading.Thread(target=process_stage, name="minol-process", daemon=True)]
+    for stage in stages: stage.start()
 
-    user_info = getattr(connector, "user_info", {})
+    now = datetime.now()
+    b_start_month = config.get("billing_start_month", 9)
+    logger.info(f"📅 Abrechnungsperiode aus Config: Monat {b_start_month}")
+    published, seen = 0, set()
+    try:
+        while (item := processed_q.get()) is not None:
+            tenant = item["tenant"]
+            if tenant["index"] not in seen:
+                seen.add(tenant["index"])
+                publish_customer_info(tenant)
+            if item["data"]:
+                publish_category(tenant, item["key"], item["data"], now, b_start_month)
+                published += 1
+            else:
+                logger.warning(f"Keine Daten für {item['key']} (Mieter {tenant['user_num']})")
+    finally:
+        # Auch nach einem Fehler bis zum Ende leeren, sonst hängen die Stufen an den vollen Queues
+        while item is not None:
+            item = processed_q.get()
+        for stage in stages: stage.join()
+    logger.info(f"Sync erfolgreich beendet ({published} Kategorien veröffentlicht).")
+
+def tenant_prefix(tenant):
+    # Erster Mieter behält die bisherigen IDs, weitere bekommen ein Präfix
+    return "" if tenant["index"] == 0 else f"{tenant['slug']}_"
+
+def publish_customer_info(tenant):
+    pfx, device = tenant_prefix(tenant), tenant_device(tenant)
+    user_info = tenant.get("info") or {}
     
     # --- 0. Customer Info Sensor ---
     if user_info:
         logger.info("Publishing customer data sensor...")
         addr = f"{user_info.get('addrStreet','')} {user_info.get('addrHouseNum','')} {user_info.get('addrPostalCode','')} {user_info.get('addrCity','')}".strip()
         
-        uid = "customer_info"
+        uid = f"{pfx}customer_info"
         customer_attrs = {
             "email": user_info.get("email", ""),
             "customer_number": user_info.get("userNumber", ""),
@@ -101,17 +176,14 @@ def run_sync():
 
         publish_discovery_config(
             "info", uid, "Minol Customer Info", "", "mdi:account", None, 
-            state_class=None, attributes_topic=f"minol/{uid}/attributes"
+            state_class=None, attributes_topic=f"minol/{uid}/attributes", device=device
         )
         publish_state(uid, customer_attrs["customer_number"])
         publish_attributes(uid, customer_attrs)
-    
-    now = datetime.now()
-    
-    # Abrechnungsperiode aus Config (Benutzer trägt seinen Monat ein)
-    b_start_month = config.get("billing_start_month", 9)
-    logger.info(f"📅 Abrechnungsperiode aus Config: Monat {b_start_month}")
-    
+
+def publish_category(tenant, k, cat_data, now, b_start_month):
+    pfx, device = tenant_prefix(tenant), tenant_device(tenant)
+    name, unit, icon, devc = CATEGORIES[k]
     ww_faktor = config.get("ww_factor", 58.15)
     
     current_month, current_year = now.month, now.year
@@ -124,68 +196,53 @@ def run_sync():
         b_last_start, b_last_end = current_year - 2, current_year - 1
         months_active = (12 - b_start_month) + current_month + 1
 
-    cats = {
-        "heating": ("Heizung", "kWh", "mdi:radiator", "energy"),
-        "hot_water": ("Warmwasser", "m³", "mdi:water-thermometer", "water"),
-        "cold_water": ("Kaltwasser", "m³", "mdi:water-pump", "water")
-    }
-
     # --- 1. Perioden-Sensoren ---
-    for k, (name, unit, icon, devc) in cats.items():
-        if k in data and "timeline" in data[k]:
-            real_months = [e for e in data[k]["timeline"] if e.get("label") != "REF"]
-            
-            # Aktuelle Periode
-            raw_curr = sum(float(e.get("value", 0) or 0) for e in real_months[-months_active:])
-            val_curr = round(raw_curr / ww_faktor, 2) if k == "hot_water" else round(raw_curr, 2)
-            uid_c = f"{k}_period_current"
-            publish_discovery_config(k, uid_c, f"Minol {name} Aktuelle Periode", unit, icon, devc, "total_increasing", f"minol/{uid_c}/attributes")
-            publish_state(uid_c, val_curr)
-            publish_attributes(uid_c, {"zeitraum": f"{b_curr_start}/{b_curr_end}", "monate_aktiv": months_active})
-
-            # Letzte Periode
-            s_idx, e_idx = len(real_months) - months_active - 12, len(real_months) - months_active
-            raw_last = sum(float(e.get("value", 0) or 0) for e in real_months[s_idx:e_idx]) if s_idx >= 0 else 0
-            val_last = round(raw_last / ww_faktor, 2) if k == "hot_water" else round(raw_last, 2)
-            uid_l = f"{k}_period_last"
-            publish_discovery_config(k, uid_l, f"Minol {name} Letzte Periode", unit, icon, devc, "total", f"minol/{uid_l}/attributes")
-            publish_state(uid_l, val_last)
-            publish_attributes(uid_l, {"zeitraum": f"{b_last_start}/{b_last_end}", "monate_voll": 12 if s_idx >= 0 else 0})
+    if "timeline" in cat_data:
+        real_months = [e for e in cat_data["timeline"] if e.get("label") != "REF"]
+        
+        # Aktuelle Periode
+        raw_curr = sum(float(e.get("value", 0) or 0) for e in real_months[-months_active:])
+        val_curr = round(raw_curr / ww_faktor, 2) if k == "hot_water" else round(raw_curr, 2)
+        uid_c = f"{pfx}{k}_period_current"
+        publish_discovery_config(k, uid_c, f"Minol {name} Aktuelle Periode", unit, icon, devc, "total_increasing", f"minol/{uid_c}/attributes", device)
+        publish_state(uid_c, val_curr)
+        publish_attributes(uid_c, {"zeitraum": f"{b_curr_start}/{b_curr_end}", "monate_aktiv": months_active})
+
+        # Letzte Periode
+        s_idx, e_idx = len(real_months) - months_active - 12, len(real_months) - months_active
+        raw_last = sum(float(e.get("value", 0) or 0) for e in real_months[s_idx:e_idx]) if s_idx >= 0 else 0
+        val_last = round(raw_last / ww_faktor, 2) if k == "hot_water" else round(raw_last, 2)
+        uid_l = f"{pfx}{k}_period_last"
+        publish_discovery_config(k, uid_l, f"Minol {name} Letzte Periode", unit, icon, devc, "total", f"minol/{uid_l}/attributes", device)
+        publish_state(uid_l, val_last)
+        publish_attributes(uid_l, {"zeitraum": f"{b_last_start}/{b_last_end}", "monate_voll": 12 if s_idx >= 0 else 0})
 
     # --- 2. Zimmer-Sensoren (Ohne WW-Faktor, Null-Werte gefiltert) ---
-    def process_rooms(category_key, category_name, unit, icon, device_class):
-        if category_key not in data or "by_room" not in data[category_key]: return
-        for room in data[category_key]["by_room"]:
-            r_name = room.get("room_name", "Unknown")
-            device_num = str(room.get("device_number", "unknown"))
-            
-            safe_room = ''.join(e for e in r_name if e.isalnum()).lower()
-            uid = f"{category_key}_{safe_room}_{device_num}"
-            
-            # KEIN Warmwasser-Faktor bei Räumen! Nur RAW-Werte
-            val = room.get("consumption", 0)
-            
-            # Filtere Null-Werte raus
-            if val <= 0:
-                continue
-            
-            publish_discovery_config(category_key, uid, f"Minol {r_name} {category_name} ({device_num})", unit, icon, device_class, "total_increasing", f"minol/{uid}/attributes")
-            publish_state(uid, val)
-            
-            attrs = {
-                "room_name": r_name,
-                "device_number": device_num,
-                "current_reading": room.get("reading", 0),
-                "initial_reading": room.get("initial_reading", 0),
-                "monthly_history": data[category_key].get("timeline", [])
-            }
-            publish_attributes(uid, attrs)
-
-    process_rooms("heating", "Heizung", "kWh", "mdi:radiator", "energy")
-    process_rooms("hot_water", "Warmwasser", "m³", "mdi:water-thermometer", "water")
-    process_rooms("cold_water", "Kaltwasser", "m³", "mdi:water-pump", "water")
-    
-    logger.info("Sync erfolgreich beendet.")
+    for room in cat_data.get("by_room", []):
+        r_name = room.get("room_name", "Unknown")
+        device_num = str(room.get("device_number", "unknown"))
+        
+        safe_room = ''.join(e for e in r_name if e.isalnum()).lower()
+        uid = f"{pfx}{k}_{safe_room}_{device_num}"
+        
+        # KEIN Warmwasser-Faktor bei Räumen! Nur RAW-Werte
+        val = room.get("consumption", 0)
+        
+        # Filtere Null-Werte raus
+        if val <= 0:
+            continue
+        
+        publish_discovery_config(k, uid, f"Minol {r_name} {name} ({device_num})", unit, icon, devc, "total_increasing", f"minol/{uid}/attributes", device)
+        publish_state(uid, val)
+        
+        attrs = {
+            "room_name": r_name,
+            "device_number": device_num,
+            "current_reading": room.get("reading", 0),
+            "initial_reading": room.get("initial_reading", 0),
+            "monthly_history": cat_data.get("timeline", [])
+        }
+        publish_attributes(uid, attrs)
 
 if __name__ == "__main__":
     connect_mqtt()
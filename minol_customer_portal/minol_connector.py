@@ -6,13 +6,18 @@ using Playwright for Azure B2C SAML authentication and requests for API calls.
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import json
+import os
+import re
 import logging
 import base64
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, urljoin
 from playwright.sync_api import sync_playwright
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Optional, List
 from datetime import datetime, timedelta
 
@@ -22,12 +27,58 @@ DEFAULT_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36"
 }
 
+# (result key, consType, dlgKey, type identifier)
+CONSUMPTION_CATEGORIES = [
+    ("heating", "HZKWH", "100KWH", "HEIZUNG"),
+    ("hot_water", "WARMWASSER", "100WW", "WARMWASSER"),
+    ("cold_water", "KALTWASSER", "100KW", "KALTWASSER"),
+]
+
+# Upper bound for concurrent readData requests across all tenants
+MAX_PARALLEL_REQUESTS = 6
+
+# (connect, read) timeout in seconds for all portal requests
+REQUEST_TIMEOUT = (10, 60)
+
+# Resources the browser login does not need
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "imageset", "texttrack", "manifest"}
+BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net", "hotjar.com", "clarity.ms")
+
+# Timeout in milliseconds for page loads and the SAML redirect in the browser login
+BROWSER_TIMEOUT = 45000
+
+# Session cookies survive add-on restarts here
+SESSION_FILE = "/data/minol_session.json"
+
+# Chart entries of closed months, keyed by userNum -> consType -> YYYYMM
+MONTH_CACHE_FILE = "/data/minol_month_cache.json"
+
+# The full readData window (room table, closed months) is reloaded at most this often
+FULL_WINDOW_REFRESH = timedelta(hours=24)
+
+
+def _shift_month(yyyymm: str, months: int) -> str:
+    """Add (or subtract) months to a YYYYMM string."""
+    index = int(yyyymm[:4]) * 12 + int(yyyymm[4:]) - 1 + months
+    return f"{index // 12:04d}{index % 12 + 1:02d}"
+
+
+def _month_key(entry: Dict) -> Optional[str]:
+    """Return the YYYYMM month of a chart entry, or None if it cannot be determined."""
+    for value in (entry.get("categoryInt"), entry.get("category")):
+        text = str(value or "")
+        if len(text) == 6 and text.isdigit():
+            return text
+    return None
+
 
 class MinolConnector:
     """Minol customer portal API client with Playwright-based authentication."""
 
-    def __init__(self, email: str, password: str, base_url: str = "https://webservices.minol.com"):
-        """Initialize the connector with user credentials."""
+    def __init__(self, email: str, password: str, base_url: str = "https://webservices.minol.com",
+                 session_file: Optional[str] = SESSION_FILE, billing_start_month: Optional[int] = None,
+                 cache_file: Optional[str] = MONTH_CACHE_FILE):
+        """Initialize the connector with user credentials and restore saved session cookies and month cache."""
         self.email = email
         self.password = password
 
@@ -36,78 +87,305 @@ class MinolConnector:
         self.acs_url = f"{base_url}/saml2/sp/acs"
 
         self.session = requests.Session()
+        # One keep-alive pool shared by the concurrent category requests
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL_REQUESTS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36"
         })
 
         self.user_tenants = None
         self.user_num = None
+        self.tenants: List[Dict] = []
         self.user_info = {}
         self.csrf_token = None
         self._authenticated = False
         self._last_data: Optional[Dict] = None
         self._last_update: Optional[datetime] = None
         self._cache_duration = timedelta(hours=1)
+        self.session_file = session_file
+        self._load_session()
+        self.billing_start_month = billing_start_month
+        self.cache_file = cache_file
+        self._cache_lock = threading.Lock()
+        self._month_cache: Dict = {}
+        self._full_window: Dict = {}
+        self._load_month_cache()
+
+    def _load_month_cache(self):
+        """Load the closed-month cache from disk."""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                self._month_cache = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load month cache: {e}")
+
+    def _store_closed_months(self, cons_type, chart, timeline_start, open_from, user_num=None):
+        """
+        Store the chart entries of all months in [timeline_start, open_from) in the cache.
+
+        Months without chart entries are stored as empty lists so they count as cached.
+        """
+        months = {}
+        month = timeline_start
+        while month < open_from:
+            months[month] = []
+            month = _shift_month(month, 1)
+        for entry in chart or []:
+            key = _month_key(entry)
+            if key is None:
+                logger.debug(f"Chart entry without month key, not caching {cons_type}")
+                return
+            if key in months:
+                months[key].append(entry)
+
+        with self._cache_lock:
+            self._month_cache.setdefault(str(user_num or self.user_num), {}).setdefault(cons_type, {}).update(months)
+            if not self.cache_file:
+                return
+            try:
+                tmp = f"{self.cache_file}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._month_cache, f)
+                os.replace(tmp, self.cache_file)
+            except Exception as e:
+                logger.warning(f"Could not save month cache: {e}")
+
+    def _cached_months(self, cons_type, timeline_start, open_from, user_num=None) -> Optional[List[Dict]]:
+        """Return the cached chart entries for [timeline_start, open_from), or None if any month is missing."""
+        with self._cache_lock:
+            cached = self._month_cache.get(str(user_num or self.user_num), {}).get(cons_type, {})
+            entries = []
+            month = timeline_start
+            while month < open_from:
+                if month not in cached:
+                    return None
+                entries.extend(cached[month])
+                month = _shift_month(month, 1)
+            return entries
+
+    def open_period_start(self, now: Optional[datetime] = None) -> Optional[str]:
+        """
+        First month (YYYYMM) whose chart values are not served from the month cache.
+
+        This is the start of the open billing period, but never later than the
+        previous month so that late readings of the last month are picked up.
+        """
+        if not self.billing_start_month:
+            return None
+        now = now or datetime.now()
+        year = now.year if now.month >= self.billing_start_month else now.year - 1
+        period_start = f"{year:04d}{self.billing_start_month:02d}"
+        return min(period_start, _shift_month(now.strftime("%Y%m"), -1))
+
+    def _load_session(self):
+        """Restore cookies from a previous run, if any."""
+        if not self.session_file or not os.path.exists(self.session_file):
+            return
+        try:
+            with open(self.session_file, "r", encoding="utf-8") as f:
+                cookies = json.load(f).get("cookies", [])
+            for cookie in cookies:
+                self.session.cookies.set(
+                    name=cookie["name"],
+                    value=cookie["value"],
+                    domain=cookie.get("domain", ""),
+                    path=cookie.get("path", "/"),
+                    secure=cookie.get("secure", False),
+                    expires=cookie.get("expires"),
+                )
+            logger.info(f"Restored {len(cookies)} session cookies")
+        except Exception as e:
+            logger.warning(f"Could not restore saved session: {e}")
+
+    def _save_session(self):
+        """Persist the current session cookies."""
+        if not self.session_file:
+            return
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "secure": c.secure, "expires": c.expires}
+            for c in self.session.cookies
+        ]
+        try:
+            tmp = f"{self.session_file}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"cookies": cookies}, f)
+            os.replace(tmp, self.session_file)
+        except Exception as e:
+            logger.warning(f"Could not save session: {e}")
+
+    def _probe_session(self) -> bool:
+        """
+        Check the current cookies with a cheap getUserTenants request.
+
+        Returns:
+            bool: True if the session is valid (tenant data is loaded as a side effect)
+        """
+        if not len(self.session.cookies):
+            return False
+        try:
+            self.get_user_tenants(quiet=True)
+            return True
+        except Exception as e:
+            logger.info(f"Saved session is not valid: {e}")
+            return False
 
     def login(self):
-        """Perform Azure B2C SAML authentication using Playwright."""
+        """Perform Azure B2C SAML authentication, via plain HTTP first and Playwright as fallback."""
+        try:
+            # A MYSAPSSO2 cookie alone does not prove the session works, confirm it with the probe
+            if self._http_login():
+                if self._probe_session():
+                    self._authenticated = True
+                    return
+                logger.warning("HTTP login session is not usable")
+        except Exception as e:
+            logger.warning(f"HTTP login failed: {e}")
+        self.session.cookies.clear()
+        logger.info("Falling back to browser login")
+        self._browser_login()
+
+    def _post_saml_forms(self, response, max_hops: int = 5):
+        """Submit auto-post SAML forms (SAMLRequest/SAMLResponse) until a regular page is reached."""
+        for _ in range(max_hops):
+            soup = BeautifulSoup(response.text, "html.parser")
+            form = next((f for f in soup.find_all("form")
+                         if f.find("input", attrs={"name": re.compile("^SAML(Request|Response)$")})), None)
+            if form is None:
+                return response
+            fields = {i.get("name"): i.get("value", "") for i in form.find_all("input") if i.get("name")}
+            default = self.acs_url if "SAMLResponse" in fields else response.url
+            action = urljoin(response.url, form.get("action") or default)
+            if "SAMLResponse" in fields:
+                logger.info(f"Forwarding SAML assertion to {urlparse(action).path}")
+            response = self.session.post(action, data=fields, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+        return response
+
+    def _http_login(self) -> bool:
+        """
+        Replay the Azure B2C self-asserted sign-in with requests, without a browser.
+
+        Returns:
+            bool: True if the MYSAPSSO2 cookie was obtained
+        """
+        logger.info("Starting HTTP authentication...")
+        monitoring_url = f"{self.base_url}/minol.com~kundenportal~em~web/resources/monitoring/index.html?isMieter=true&redirect2=true"
+        response = self.session.get(monitoring_url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        response = self._post_saml_forms(response)
+
+        if "b2clogin.com" not in urlparse(response.url).netloc:
+            logger.info("No B2C login page reached")
+            return "MYSAPSSO2" in self.session.cookies
+
+        match = re.search(r"var SETTINGS\s*=\s*(\{.*?\});", response.text, re.S)
+        if not match:
+            logger.info("B2C settings not found on login page")
+            return False
+        settings = json.loads(match.group(1))
+        csrf, trans_id = settings["csrf"], settings["transId"]
+        tenant, policy = settings["hosts"]["tenant"], settings["hosts"]["policy"]
+        api = settings.get("api", "CombinedSigninAndSignup")
+        b2c = f"{urlparse(response.url).scheme}://{urlparse(response.url).netloc}{tenant}"
+
+        # 1. Credentials against the self-asserted endpoint
+        result = self.session.post(
+            f"{b2c}/SelfAsserted",
+            params={"tx": trans_id, "p": policy},
+            data={"request_type": "RESPONSE", "signInName": self.email, "password": self.password},
+            headers={"X-CSRF-TOKEN": csrf, "X-Requested-With": "XMLHttpRequest", "Referer": response.url},
+            timeout=REQUEST_TIMEOUT,
+        )
+        result.raise_for_status()
+        status = result.json() if "json" in result.headers.get("Content-Type", "") else {}
+        if str(status.get("status")) != "200":
+            logger.warning(f"B2C rejected credentials: {status.get('message', result.text[:200])}")
+            return False
+
+        # 2. Confirmation page carries the SAML assertion for the portal
+        confirmed = self.session.get(
+            f"{b2c}/api/{api}/confirmed",
+            params={"rememberMe": "false", "csrf_token": csrf, "tx": trans_id, "p": policy},
+            timeout=REQUEST_TIMEOUT,
+        )
+        confirmed.raise_for_status()
+        self._post_saml_forms(confirmed)
+
+        if "MYSAPSSO2" in self.session.cookies:
+            logger.info("MYSAPSSO2 cookie obtained via HTTP login")
+            return True
+        logger.warning("HTTP login finished without MYSAPSSO2 cookie")
+        return False
+
+    def _browser_login(self):
+        """Perform Azure B2C SAML authentication using a lean Playwright profile."""
         logger.info("Starting Playwright authentication...")
+        timings = {}
+        started = last = time.monotonic()
+
+        def step(name):
+            nonlocal last
+            now = time.monotonic()
+            timings[name] = now - last
+            last = now
+
+        def block(route):
+            # Only documents, scripts, XHR and stylesheets are needed for the login flow
+            request = route.request
+            if request.resource_type in BLOCKED_RESOURCE_TYPES or any(h in request.url for h in BLOCKED_HOSTS):
+                route.abort()
+            else:
+                route.continue_()
 
         with sync_playwright() as p:
             browser = p.chromium.launch(
                 headless=True,
-                args=["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage"]
+                args=["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage",
+                      "--disable-extensions", "--disable-gpu", "--no-first-run"]
             )
             context = browser.new_context()
+            context.route("**/*", block)
             page = context.new_page()
+            step("launch")
 
             try:
                 logger.info("Navigating to monitoring page...")
                 monitoring_url = f"{self.base_url}/minol.com~kundenportal~em~web/resources/monitoring/index.html?isMieter=true&redirect2=true"
-                page.goto(monitoring_url, wait_until="networkidle", timeout=90000)
-
-                time.sleep(3)
-                logger.info(f"Current URL: {page.url}")
-
-                if "minolauth.b2clogin.com" in page.url:
-                    logger.info("On Azure B2C login page")
-                else:
-                    logger.info("Checking for login redirect...")
-                    page_content = page.content()
-                    with open("current_page.html", "w", encoding="utf-8") as f:
-                        f.write(page_content)
-
-                    try:
-                        page.wait_for_url("**/minolauth.b2clogin.com/**", timeout=5000)
-                    except Exception:
-                        logger.warning("No redirect to Azure B2C detected")
+                page.goto(monitoring_url, wait_until="domcontentloaded", timeout=BROWSER_TIMEOUT)
+                try:
+                    page.wait_for_url("**/minolauth.b2clogin.com/**", timeout=10000)
+                except Exception:
+                    logger.info(f"No redirect to Azure B2C, current URL: {page.url}")
+                step("redirect")
 
                 if "minolauth.b2clogin.com" in page.url:
                     logger.info("Filling login form...")
-                    time.sleep(2)
-
                     email_input = page.locator('input[id="signInName"], input[name="signInName"], input[type="email"], input[placeholder*="Kundennummer"]')
-                    email_input.wait_for(state="visible", timeout=10000)
+                    email_input.wait_for(state="visible", timeout=15000)
                     email_input.fill(self.email)
 
                     password_input = page.locator('input[id="password"], input[name="password"], input[type="password"]')
                     password_input.wait_for(state="visible", timeout=5000)
                     password_input.fill(self.password)
 
-                    sign_in_button = page.locator('button[type="submit"], button#next')
-                    sign_in_button.click()
+                    # The portal sets the SSO cookie in its answer to the SAML assertion POST
+                    with page.expect_response(lambda r: "/saml2/sp/acs" in r.url and r.request.method == "POST",
+                                              timeout=BROWSER_TIMEOUT):
+                        page.locator('button[type="submit"], button#next').click()
+                        step("form")
+                        logger.info("Waiting for SAML assertion...")
+                    step("saml")
 
-                    logger.info("Waiting for redirect...")
-                    page.wait_for_url(f"{self.base_url}/**", timeout=30000)
-                    time.sleep(2)
+                    page.wait_for_url(f"{self.base_url}/**", timeout=BROWSER_TIMEOUT)
 
                     logger.info("Navigating to monitoring page...")
-                    page.goto(monitoring_url, wait_until="networkidle")
-                    time.sleep(3)
-                else:
-                    logger.info("Checking authentication status...")
+                    page.goto(monitoring_url, wait_until="domcontentloaded", timeout=BROWSER_TIMEOUT)
+                    step("monitoring")
 
-                logger.info("Extracting cookies...")
                 cookies = context.cookies()
 
                 for cookie in cookies:
@@ -133,7 +411,8 @@ class MinolConnector:
             finally:
                 browser.close()
 
-        logger.info("Login successful.")
+        steps = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items())
+        logger.info(f"Login successful in {time.monotonic() - started:.1f}s ({steps})")
         self._authenticated = True
 
 
@@ -156,7 +435,7 @@ class MinolConnector:
             'upgrade-insecure-requests': '1',
         }
         try:
-            response = self.session.get(url, headers=headers, allow_redirects=True)
+            response = self.session.get(url, headers=headers, allow_redirects=True, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             with open("monitoring_index_page.html", "w", encoding="utf-8") as f:
                 f.write(response.text)
@@ -171,7 +450,7 @@ class MinolConnector:
         logger.info("Getting monitoring client...")
         url = f"{self.base_url}/irj/servlet/prt/portal/prtroot/pcd!3aportal_content!2fminol!2ff_PortalLayouts!2fv_monitoringClient"
         try:
-            response = self.session.get(url, allow_redirects=True)
+            response = self.session.get(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             with open("monitoring_page_response.html", "w", encoding="utf-8") as f:
                 f.write(response.text)
@@ -181,9 +460,15 @@ class MinolConnector:
             logger.error(f"Error getting monitoring client: {e}")
             raise
 
-    def get_user_tenants(self):
-        """Fetch user tenants to extract the userNum and profile data."""
+    def get_user_tenants(self, quiet=False):
+        """
+        Fetch user tenants to extract the userNum and profile data.
+
+        Args:
+            quiet (bool): Log an invalid session at debug level only (used by the session probe)
+        """
         logger.info("Fetching user tenants...")
+        warn, error = (logger.debug, logger.debug) if quiet else (logger.warning, logger.error)
         url = f"{self.base_url}/minol.com~kundenportal~em~web/rest/EMData/getUserTenants"
         headers = {
             'Accept': 'application/json, text/javascript, */*; q=0.01',
@@ -192,14 +477,14 @@ class MinolConnector:
             'X-Requested-With': 'XMLHttpRequest'
         }
         try:
-            response = self.session.get(url, headers=headers)
+            response = self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             
             # Prüfe ob Response wirklich JSON ist
             content_type = response.headers.get('Content-Type', '')
             if 'application/json' not in content_type:
-                logger.warning(f"Unexpected content type: {content_type}")
-                logger.warning(f"Response content: {response.text[:200]}")
+                warn(f"Unexpected content type: {content_type}")
+                warn(f"Response content: {response.text[:200]}")
                 # Session wahrscheinlich abgelaufen - erzwinge Re-Login
                 self._authenticated = False
                 logger.info("Session appears to be invalid, marking as unauthenticated")
@@ -208,60 +493,108 @@ class MinolConnector:
             self.user_tenants = response.json()
             
             if self.user_tenants and len(self.user_tenants) > 0:
-                # Hier ziehen wir die Daten für das Profil (Index 0)
+                # Jeder Mieter/jede Nutzeinheit wird ein eigenes Gerät; Index 0 bleibt das bisherige Profil
+                self.tenants = []
+                for tenant_data in self.user_tenants:
+                    user_num = tenant_data.get("userNumber")
+                    if any(t["user_num"] == user_num for t in self.tenants):
+                        continue
+                    self.tenants.append({
+                        "index": len(self.tenants),
+                        "user_num": user_num,
+                        "slug": "".join(c for c in str(user_num) if c.isalnum()).lower(),
+                        "info": {
+                            "userNumber": tenant_data.get("userNumber"),
+                            "lgnr": tenant_data.get("lgnr"),
+                            "name": tenant_data.get("name"),
+                            "email": tenant_data.get("email"),
+                            "addrCity": tenant_data.get("addrCity"),
+                            "addrStreet": tenant_data.get("addrStreet"),
+                            "addrHouseNum": tenant_data.get("addrHouseNum"),
+                            "addrPostalCode": tenant_data.get("addrPostalCode"),
+                            "geschossText": tenant_data.get("geschossText"),
+                            "lageText": tenant_data.get("lageText"),
+                            "einzugMieter": tenant_data.get("einzugMieter"),
+                            "nenr": tenant_data.get("nenr", "000003") # Fallback falls leer
+                        },
+                    })
+
+                # Einzelvariablen und user_info beziehen sich weiterhin auf den ersten Mieter
                 tenant_data = self.user_tenants[0]
-                
-                # 1. Einzelvariablen setzen
                 self.user_num = tenant_data.get("userNumber")
                 self.lgnr = tenant_data.get("lgnr")
                 self.full_name = tenant_data.get("name")
-                
-                # 2. WICHTIG: Das user_info Dictionary befüllen (das nutzt die main.py!)
-                self.user_info = {
-                    "userNumber": tenant_data.get("userNumber"),
-                    "lgnr": tenant_data.get("lgnr"),
-                    "name": tenant_data.get("name"),
-                    "email": tenant_data.get("email"),
-                    "addrCity": tenant_data.get("addrCity"),
-                    "addrStreet": tenant_data.get("addrStreet"),
-                    "addrHouseNum": tenant_data.get("addrHouseNum"),
-                    "addrPostalCode": tenant_data.get("addrPostalCode"),
-                    "geschossText": tenant_data.get("geschossText"),
-                    "lageText": tenant_data.get("lageText"),
-                    "einzugMieter": tenant_data.get("einzugMieter"),
-                    "nenr": tenant_data.get("nenr", "000003") # Fallback falls leer
-                }
+                self.user_info = self.tenants[0]["info"]
 
                 logger.info(f"userNum found: {self.user_num} for {self.full_name}")
+                if len(self.tenants) > 1:
+                    logger.info(f"{len(self.tenants)} tenants found: {', '.join(str(t['user_num']) for t in self.tenants)}")
             else:
                 raise ValueError("User tenants not found or empty.")
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode JSON response: {e}")
-            logger.error(f"Response text: {response.text[:500]}")
+            error(f"Failed to decode JSON response: {e}")
+            error(f"Response text: {response.text[:500]}")
             # Session abgelaufen
             self._authenticated = False
             raise ValueError("Session expired - JSON decode error")
         except Exception as e:
-            logger.error(f"Error fetching user tenants: {e}")
+            error(f"Error fetching user tenants: {e}")
             raise
 
-    def fetch_em_data(self, timeline_start, timeline_end, cons_type="HZKWH", dlg_key="100KWH"):
+    def fetch_em_data(self, timeline_start, timeline_end, cons_type="HZKWH", dlg_key="100KWH", open_from=None, user_num=None):
         """
         Fetch eMonitoring data for a specific consumption type.
 
+        The room table (consumption and readings) refers to the requested timeline,
+        so the full window is loaded at most every FULL_WINDOW_REFRESH; it refreshes
+        the closed months in the month cache and its table is kept in memory. In
+        between, only the open period (from open_from) is requested, the cached
+        closed months are put in front of its chart and the table of the last full
+        response is used.
+
         Args:
             timeline_start (str): Start period in format YYYYMM (e.g., "202411")
             timeline_end (str): End period in format YYYYMM (e.g., "202510")
             cons_type (str): Type of consumption - "HZKWH", "WARMWASSER", or "KALTWASSER"
             dlg_key (str): Dialog key, default "100KWH" for heating
+            open_from (str): First month (YYYYMM) that is not closed yet, None disables the cache
+            user_num (str): Tenant to fetch, defaults to the first tenant
 
         Returns:
             dict: JSON response containing table (per room) and chart (timeline) data
         """
+        user_num = user_num or self.user_num
+        if not open_from or open_from <= timeline_start:
+            return self._request_em_data(timeline_start, timeline_end, cons_type, dlg_key, user_num)
+
+        key = (str(user_num), cons_type)
+        with self._cache_lock:
+            full = self._full_window.get(key)
+        cached = self._cached_months(cons_type, timeline_start, open_from, user_num)
+        if (cached is None or not full or full["start"] != timeline_start
+                or datetime.now() - full["fetched"] > FULL_WINDOW_REFRESH):
+            raw = self._request_em_data(timeline_start, timeline_end, cons_type, dlg_key, user_num)
+            self._store_closed_months(cons_type, raw.get("chart"), timeline_start, open_from, user_num)
+            with self._cache_lock:
+                self._full_window[key] = {
+                    "start": timeline_start,
+                    "fetched": datetime.now(),
+                    "table": raw.get("table"),
+                    "dashboardHeader": raw.get("dashboardHeader"),
+                }
+            return raw
+
+        raw = self._request_em_data(open_from, timeline_end, cons_type, dlg_key, user_num)
+        raw["chart"] = cached + [e for e in raw.get("chart") or [] if (_month_key(e) or open_from) >= open_from]
+        raw["table"], raw["dashboardHeader"] = full["table"], full["dashboardHeader"]
+        return raw
+
+    def _request_em_data(self, timeline_start, timeline_end, cons_type, dlg_key, user_num=None):
+        """Request eMonitoring data for one consumption type and period from the portal."""
         logger.info(f"Fetching eMonitoring data for {cons_type} from {timeline_start} to {timeline_end}")
         url = f"{self.base_url}/minol.com~kundenportal~em~web/rest/EMData/readData"
         payload = {
-            "userNum": self.user_num,
+            "userNum": user_num or self.user_num,
             "layer": "NE",
             "scale": "CALMONTH",
             "chartRefUnit": "ABS",
@@ -287,7 +620,7 @@ class MinolConnector:
         logger.debug(f"Request Headers: {json.dumps(headers, indent=2)}")
 
         try:
-            response = self.session.post(url, headers=headers, data=json.dumps(payload))
+            response = self.session.post(url, headers=headers, data=json.dumps(payload), timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             logger.debug(f"EM data response status: {response.status_code}")
             
@@ -311,13 +644,15 @@ class MinolConnector:
             logger.error("Response content saved to em_data_error_response.html")
             raise
 
-    def get_all_consumption_data(self, timeline_start, timeline_end):
+    def get_all_consumption_data(self, timeline_start, timeline_end, open_from=None, user_num=None):
         """
         Fetch all consumption data types (heating, hot water, cold water) organized by room.
 
         Args:
             timeline_start (str): Start period in format YYYYMM (e.g., "202411")
             timeline_end (str): End period in format YYYYMM (e.g., "202510")
+            open_from (str): First month (YYYYMM) of the open period, older months come from the cache
+            user_num (str): Tenant to fetch, defaults to the first tenant
 
         Returns:
             dict: Structured consumption data with the following format:
@@ -353,34 +688,31 @@ class MinolConnector:
             }
         }
 
-        try:
-            heating_raw = self.fetch_em_data(timeline_start, timeline_end, cons_type="HZKWH", dlg_key="100KWH")
-            consumption_data["heating"] = self._process_consumption_data(
-                heating_raw, "HEIZUNG", timeline_start, timeline_end
-            )
-        except Exception as e:
-            logger.error(f"Error fetching heating data: {e}")
-            consumption_data["heating"] = {"error": str(e)}
+        # The three categories are independent requests, fetch them concurrently
+        with ThreadPoolExecutor(max_workers=len(CONSUMPTION_CATEGORIES)) as pool:
+            futures = {
+                key: pool.submit(self._fetch_category, key, cons_type, dlg_key, type_id, timeline_start, timeline_end, open_from, user_num)
+                for key, cons_type, dlg_key, type_id in CONSUMPTION_CATEGORIES
+            }
+            for key, future in futures.items():
+                consumption_data[key] = future.result()
 
-        try:
-            hot_water_raw = self.fetch_em_data(timeline_start, timeline_end, cons_type="WARMWASSER", dlg_key="100WW")
-            consumption_data["hot_water"] = self._process_consumption_data(
-                hot_water_raw, "WARMWASSER", timeline_start, timeline_end
-            )
-        except Exception as e:
-            logger.error(f"Error fetching hot water data: {e}")
-            consumption_data["hot_water"] = {"error": str(e)}
+        return consumption_data
+
+    def _fetch_category(self, key, cons_type, dlg_key, consumption_type, timeline_start, timeline_end, open_from=None, user_num=None):
+        """
+        Fetch and process a single consumption category.
 
+        Errors are returned as {"error": ...} so that one failing category
+        does not affect the others.
+        """
         try:
-            cold_water_raw = self.fetch_em_data(timeline_start, timeline_end, cons_type="KALTWASSER", dlg_key="100KW")
-            consumption_data["cold_water"] = self._process_consumption_data(
-                cold_water_raw, "KALTWASSER", timeline_start, timeline_end
-            )
+            raw = self.fetch_em_data(timeline_start, timeline_end, cons_type=cons_type, dlg_key=dlg_key,
+                                     open_from=open_from, user_num=user_num)
+            return self._process_consumption_data(raw, consumption_type, timeline_start, timeline_end)
         except Exception as e:
-            logger.error(f"Error fetching cold water data: {e}")
-            consumption_data["cold_water"] = {"error": str(e)}
-
-        return consumption_data
+            logger.error(f"Error fetching {key.replace('_', ' ')} data: {e}")
+            return {"error": str(e)}
 
     def _process_consumption_data(self, raw_data, consumption_type, timeline_start, timeline_end):
         """
@@ -444,15 +776,23 @@ class MinolConnector:
         """
         Authenticate with the Minol portal.
 
-        This is a convenience wrapper around login() + get_user_tenants().
+        The saved session is checked first; the Playwright SAML login only runs
+        when the probe fails.
 
         Returns:
             bool: True if authentication successful, False otherwise
         """
         try:
             logger.info("Authenticating with Minol portal...")
+            if self._probe_session():
+                logger.info("Reusing saved session, no browser login needed")
+                self._authenticated = True
+                # The portal may have refreshed cookies while answering the probe
+                self._save_session()
+                return True
             self.login()
             self.get_user_tenants()
+            self._save_session()
             logger.info("Authentication successful")
             return True
         except Exception as e:
@@ -510,7 +850,7 @@ class MinolConnector:
             
             logger.debug(f"Dashboard request payload: {json.dumps(payload, indent=2)}")
             
-            response = self.session.post(url, headers=headers, data=json.dumps(payload))
+            response = self.session.post(url, headers=headers, data=json.dumps(payload), timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             
             data = response.json()
@@ -557,7 +897,8 @@ class MinolConnector:
             # Alle Verbrauchsdaten abrufen
             data = self.get_all_consumption_data(
                 timeline_start=timeline_start,
-                timeline_end=timeline_end
+                timeline_end=timeline_end,
+                open_from=self.open_period_start(end_date)
             )
 
             if not data:
@@ -573,5 +914,44 @@ class MinolConnector:
             logger.error(f"Error fetching consumption data: {e}", exc_info=True)
             return None
 
+    def iter_em_data(self, months_back: int = 12):
+        """
+        Yield raw readData responses for all tenants and categories as soon as each one arrives.
 
+        All requests share one bounded worker pool, so the sync time stays close
+        to the single-tenant latency.
 
+        Args:
+            months_back (int): Number of months to fetch
+
+        Yields:
+            dict: {"tenant", "key", "type", "raw", "error", "start", "end"}; raw is None if the request failed
+        """
+        if not self._authenticated:
+            if not self.authenticate():
+                return
+
+        end_date = datetime.now()
+        timeline_start = (end_date - timedelta(days=30 * months_back)).strftime("%Y%m")
+        timeline_end = end_date.strftime("%Y%m")
+        open_from = self.open_period_start(end_date)
+        tenants = self.tenants or [{"index": 0, "user_num": self.user_num, "slug": str(self.user_num), "info": self.user_info}]
+
+        workers = min(MAX_PARALLEL_REQUESTS, len(tenants) * len(CONSUMPTION_CATEGORIES))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self.fetch_em_data, timeline_start, timeline_end, cons_type=cons_type, dlg_key=dlg_key,
+                            open_from=open_from, user_num=tenant["user_num"]): (tenant, key, type_id)
+                for tenant in tenants
+                for key, cons_type, dlg_key, type_id in CONSUMPTION_CATEGORIES
+            }
+            for future in as_completed(futures):
+                tenant, key, type_id = futures[future]
+                item = {"tenant": tenant, "key": key, "type": type_id, "raw": None, "error": None,
+                        "start": timeline_start, "end": timeline_end}
+                try:
+                    item["raw"] = future.result()
+                except Exception as e:
+                    logger.error(f"Error fetching {key.replace('_', ' ')} data for tenant {tenant['user_num']}: {e}")
+                    item["error"] = str(e)
+                yield item